@@ -46,6 +46,8 @@
       'library.reading_progress_percent_chapter': 'Read {percent}% · {chapter}',
       'library.reading_progress_chapter': 'Last: {chapter}',
       'library.reading_progress_chapter_index': 'Chapter {index}',
+      'library.reading_time_left': '{minutes} min left',
+      'library.book_unavailable': 'Storage offline',
 
       'library.import_options': 'Import Options',
       'library.selected_file': 'Selected File:',
@@ -158,6 +160,8 @@
       'library.reading_progress_percent_chapter': '读到 {percent}% · {chapter}',
       'library.reading_progress_chapter': '上次：{chapter}',
       'library.reading_progress_chapter_index': '第{index}章',
+      'library.reading_time_left': '剩余 {minutes} 分钟',
+      'library.book_unavailable': '存储暂不可用',
 
       'library.import_options': '导入选项',
       'library.selected_file': '已选择文件：',
@@ -270,6 +274,8 @@
       'library.reading_progress_percent_chapter': '進捗 {percent}% ・ {chapter}',
       'library.reading_progress_chapter': '前回：{chapter}',
       'library.reading_progress_chapter_index': '第{index}章',
+      'library.reading_time_left': '残り {minutes} 分',
+      'library.book_unavailable': 'ストレージ未接続',
 
       'library.import_options': 'インポート設定',
       'library.selected_file': '選択したファイル：',
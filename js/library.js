@@ -200,7 +200,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 percent: typeof parsed.percent === 'number' && Number.isFinite(parsed.percent) ? parsed.percent : null,
                 updatedAt,
                 chapterTitle: typeof parsed.chapterTitle === 'string' && parsed.chapterTitle.trim() ? parsed.chapterTitle.trim() : null,
-                spineIndex: typeof parsed.spineIndex === 'number' && Number.isFinite(parsed.spineIndex) ? parsed.spineIndex : null
+                spineIndex: typeof parsed.spineIndex === 'number' && Number.isFinite(parsed.spineIndex) ? parsed.spineIndex : null,
+                bookPercent: typeof parsed.bookPercent === 'number' && Number.isFinite(parsed.bookPercent) ? parsed.bookPercent : null,
+                minutesLeft: typeof parsed.minutesLeft === 'number' && Number.isFinite(parsed.minutesLeft) ? parsed.minutesLeft : null
             };
         } catch {
             return null;
@@ -209,8 +211,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
     function formatBookProgress(progress) {
         if (!progress) return '';
-        const hasPercent = typeof progress.percent === 'number' && Number.isFinite(progress.percent);
-        const percentInt = hasPercent ? Math.max(0, Math.min(100, Math.round(progress.percent * 100))) : null;
+        const text = formatBookProgressText(progress);
+        // Whole-book position (from the server's position index) allows a time-left estimate.
+        if (text && typeof progress.bookPercent === 'number' && typeof progress.minutesLeft === 'number') {
+            return `${text} · ${t('library.reading_time_left', { minutes: progress.minutesLeft })}`;
+        }
+        return text;
+    }
+
+    function formatBookProgressText(progress) {
+        // Prefer whole-book percent; fall back to the percent within the current chapter.
+        const percent = typeof progress.bookPercent === 'number' ? progress.bookPercent : progress.percent;
+        const hasPercent = typeof percent === 'number' && Number.isFinite(percent);
+        const percentInt = hasPercent ? Math.max(0, Math.min(100, Math.round(percent * 100))) : null;
         const chapterTitle =
             progress.chapterTitle ||
             (typeof progress.spineIndex === 'number' && Number.isFinite(progress.spineIndex)
@@ -401,9 +414,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
         books.forEach(book => {
             const progress = typeof getProgress === 'function' ? getProgress(book.dir) : readBookProgress(book.dir);
-            const progressText = formatBookProgress(progress);
+            const unavailable = book.available === false; // its library root is offline
+            const progressText = unavailable ? t('library.book_unavailable') : formatBookProgress(progress);
             const card = document.createElement('a');
-            card.className = 'book-card';
+            card.className = unavailable ? 'book-card book-unavailable' : 'book-card';
             card.href = `viewer.html?book=${encodeURIComponent(book.dir)}`;
 
             // Handle cover error
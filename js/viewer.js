@@ -13,6 +13,8 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     const params = new URLSearchParams(window.location.search);
     const bookDir = params.get('book');
+    // Optional deep jump into the book, e.g. viewer.html?book=x&pos=45 (percent of the whole book)
+    const jumpPosParam = params.get('pos');
 
     if (!bookDir) {
         alert(t('reader.no_book_specified'));
@@ -149,7 +151,9 @@ document.addEventListener('DOMContentLoaded', async () => {
                 percent: typeof parsed.percent === 'number' && Number.isFinite(parsed.percent) ? parsed.percent : null,
                 updatedAt,
                 chapterTitle: typeof parsed.chapterTitle === 'string' && parsed.chapterTitle.trim() ? parsed.chapterTitle.trim() : null,
-                spineIndex: typeof parsed.spineIndex === 'number' && Number.isFinite(parsed.spineIndex) ? parsed.spineIndex : null
+                spineIndex: typeof parsed.spineIndex === 'number' && Number.isFinite(parsed.spineIndex) ? parsed.spineIndex : null,
+                bookPercent: typeof parsed.bookPercent === 'number' && Number.isFinite(parsed.bookPercent) ? parsed.bookPercent : null,
+                minutesLeft: typeof parsed.minutesLeft === 'number' && Number.isFinite(parsed.minutesLeft) ? parsed.minutesLeft : null
             };
         } catch {
             return null;
@@ -169,7 +173,9 @@ document.addEventListener('DOMContentLoaded', async () => {
             ,
             updatedAt: existing ? existing.updatedAt : null,
             chapterTitle: null,
-            spineIndex: null
+            spineIndex: null,
+            bookPercent: null,
+            minutesLeft: null
         };
 
         if (existing && existing.href === nextHref) {
@@ -177,6 +183,8 @@ document.addEventListener('DOMContentLoaded', async () => {
             next.percent = existing.percent;
             next.chapterTitle = existing.chapterTitle;
             next.spineIndex = existing.spineIndex;
+            next.bookPercent = existing.bookPercent;
+            next.minutesLeft = existing.minutesLeft;
         } else {
             next.percent = 0;
         }
@@ -191,11 +199,92 @@ document.addEventListener('DOMContentLoaded', async () => {
         if (typeof patch.chapterTitle === 'string') next.chapterTitle = patch.chapterTitle.trim() || null;
         if (typeof patch.spineIndex === 'number' && Number.isFinite(patch.spineIndex)) next.spineIndex = patch.spineIndex;
 
+        const bookPosition = computeBookPosition(next.href, next.anchor, next.percent);
+        if (bookPosition) {
+            next.bookPercent = bookPosition.bookPercent;
+            next.minutesLeft = bookPosition.minutesLeft;
+        }
+
         try {
             localStorage.setItem(BOOK_KEY, JSON.stringify(next));
         } catch { }
     }
 
+    // --- Position Index (whole-book progress & deep jumps, see /api/books/<dir>/positions) ---
+    let positionIndex = null;
+    let positionIndexPromise = null;
+
+    function loadPositionIndex() {
+        if (positionIndexPromise) return positionIndexPromise;
+        positionIndexPromise = fetch(`/api/books/${encodeURIComponent(bookDir)}/positions`)
+            .then(res => (res.ok ? res.json() : null))
+            .then(index => {
+                if (!index || !Array.isArray(index.chapters) || !(index.totalChars > 0)) return null;
+                index.byHref = new Map(index.chapters.map(ch => [ch.href, ch]));
+                positionIndex = index;
+                return index;
+            })
+            .catch(() => null);
+        return positionIndexPromise;
+    }
+
+    function findBlockIndex(chapter, anchorId) {
+        if (!anchorId) return -1;
+        if (anchorId.startsWith(AUTO_ANCHOR_PREFIX)) {
+            const idx = Number.parseInt(anchorId.slice(AUTO_ANCHOR_PREFIX.length), 10);
+            return Number.isInteger(idx) && idx >= 0 && idx < chapter.blocks ? idx : -1;
+        }
+        if (!chapter.blockById) {
+            chapter.blockById = new Map(Object.entries(chapter.ids || {}).map(([idx, id]) => [id, Number(idx)]));
+        }
+        return chapter.blockById.has(anchorId) ? chapter.blockById.get(anchorId) : -1;
+    }
+
+    function computeBookPosition(href, anchorId, percent) {
+        if (!positionIndex || !href) return null;
+        const chapter = positionIndex.byHref.get(href);
+        if (!chapter) return null;
+
+        const blockIndex = findBlockIndex(chapter, anchorId);
+        const withinChapter = blockIndex >= 0
+            ? chapter.offsets[blockIndex]
+            : (typeof percent === 'number' && Number.isFinite(percent) ? percent : 0) * chapter.chars;
+        const position = Math.min(positionIndex.totalChars, chapter.start + withinChapter);
+        return {
+            bookPercent: position / positionIndex.totalChars,
+            minutesLeft: Math.max(0, Math.round((positionIndex.totalChars - position) / (positionIndex.charsPerMinute || 1000)))
+        };
+    }
+
+    function locateBookPercent(fraction) {
+        if (!positionIndex) return null;
+        const target = Math.max(0, Math.min(1, fraction)) * positionIndex.totalChars;
+        const chapters = positionIndex.chapters;
+        let chapter = chapters[0];
+        for (const ch of chapters) {
+            if (ch.chars > 0 && ch.start <= target) chapter = ch;
+        }
+        if (!chapter) return null;
+
+        const offsets = chapter.offsets || [];
+        const local = target - chapter.start;
+        let lo = 0;
+        let hi = offsets.length - 1;
+        let blockIndex = -1;
+        while (lo <= hi) {
+            const mid = (lo + hi) >> 1;
+            if (offsets[mid] <= local) {
+                blockIndex = mid;
+                lo = mid + 1;
+            } else {
+                hi = mid - 1;
+            }
+        }
+        if (blockIndex < 0) return chapter.href;
+        const anchorId = (chapter.ids && chapter.ids[blockIndex]) || `${AUTO_ANCHOR_PREFIX}${blockIndex}`;
+        return `${chapter.href}#${anchorId}`;
+    }
+
     function resolveBookHref(baseDir, href) {
         if (!href) return href;
         if (/^[a-zA-Z][a-zA-Z0-9+.-]*:/.test(href)) return href;
@@ -599,6 +688,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     async function loadToc() {
         try {
             tocLoaded = false;
+            const positionIndexReady = loadPositionIndex();
             // Step 1: Find OPF
             const containerRes = await fetchAsset(`${bookDir}/META-INF/container.xml`);
             if (!containerRes.ok) throw new Error('Could not load container.xml');
@@ -658,6 +748,16 @@ document.addEventListener('DOMContentLoaded', async () => {
                 tocLoaded = await loadNcx(ncxPath);
             }
 
+            // Deep jump (?pos=45) resolved from the position index without fetching other chapters
+            const jumpPos = jumpPosParam !== null ? Number.parseFloat(jumpPosParam) : NaN;
+            if (Number.isFinite(jumpPos) && await positionIndexReady) {
+                const target = locateBookPercent(jumpPos / 100);
+                if (target && spineItems.some(i => i.href === target.split('#')[0])) {
+                    loadChapter(target);
+                    return;
+                }
+            }
+
             // Restore Progress
             const savedProgress = readProgress();
             const savedLocation = savedProgress
@@ -964,6 +1064,16 @@ document.addEventListener('DOMContentLoaded', async () => {
                 const fullPath = resolveBookHref(baseDir, src) || `${baseDir}/${src}`;
                 img.setAttribute('src', fullPath);
             }
+            // Responsive variants generated at import time (e.g. "a.480w.webp 480w, a.960w.webp 960w")
+            const srcset = img.getAttribute('srcset');
+            if (srcset) {
+                const resolved = srcset.split(',').map(candidate => {
+                    const [url, ...descriptors] = candidate.trim().split(/\s+/);
+                    if (!url || url.startsWith('http') || url.startsWith('/') || url.startsWith('data:')) return candidate.trim();
+                    return [resolveBookHref(baseDir, url) || `${baseDir}/${url}`, ...descriptors].join(' ');
+                });
+                img.setAttribute('srcset', resolved.join(', '));
+            }
             img.setAttribute('loading', 'lazy');
         }
 
@@ -0,0 +1,134 @@
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Run from the project root:
+#   python scripts/bench_metadata.py [book_dir ...] [--repeat N]
+#   python scripts/bench_metadata.py --synthetic 1000 [--baseline REV]
+#
+# --synthetic N builds a throwaway book whose manifest lists N pages and N images
+# (plus a deep text/ tree, as in large comics and manga) instead of using the library.
+# --baseline REV also times get_book_metadata from server.py at git revision REV,
+# e.g. the commit before the container.xml/lxml rewrite.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+import server
+
+
+def build_synthetic_book(library_root, pages):
+    """Write a book with a 2*pages item manifest and an EPUB2 cover on the last image."""
+    book_dir = f'synthetic-{pages}'
+    content_root = os.path.join(library_root, book_dir, 'OEBPS')
+    os.makedirs(os.path.join(content_root, 'images'))
+    os.makedirs(os.path.join(library_root, book_dir, 'META-INF'))
+    with open(os.path.join(library_root, book_dir, 'META-INF', 'container.xml'), 'w') as f:
+        f.write('<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                '</rootfiles></container>')
+    items = ''.join(
+        f'<item id="p{i}" href="text/p{i}.xhtml" media-type="application/xhtml+xml"/>'
+        f'<item id="i{i}" href="images/p{i}.jpg" media-type="image/jpeg"/>'
+        for i in range(pages)
+    )
+    spine = ''.join(f'<itemref idref="p{i}"/>' for i in range(pages))
+    with open(os.path.join(content_root, 'content.opf'), 'w') as f:
+        f.write('<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf">'
+                '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                f'<dc:title>Synthetic {pages}</dc:title><dc:creator>Bench</dc:creator>'
+                f'<meta name="cover" content="i{pages - 1}"/></metadata>'
+                f'<manifest>{items}</manifest><spine>{spine}</spine></package>')
+    with open(os.path.join(content_root, 'images', f'p{pages - 1}.jpg'), 'wb') as f:
+        f.write(b'x')
+    for i in range(min(pages, 300)):
+        text_dir = os.path.join(content_root, 'text', f'd{i}')
+        os.makedirs(text_dir)
+        with open(os.path.join(text_dir, 'f.xhtml'), 'w') as f:
+            f.write('x')
+    return book_dir
+
+
+def load_baseline(rev, work_dir):
+    """Import server.py as it was at git revision rev; it only knows LIBRARY_FOLDER."""
+    source = subprocess.run(
+        ['git', 'show', f'{rev}:server.py'], cwd=PROJECT_ROOT,
+        check=True, capture_output=True, text=True,
+    ).stdout
+    path = os.path.join(work_dir, 'server_baseline.py')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location('server_baseline', path)
+    module = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(work_dir)  # the old module creates its upload/library folders on import
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+def time_best(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time get_book_metadata on library or synthetic books.")
+    parser.add_argument('books', nargs='*', help="Book directories (default: whole library)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per book; the best is reported (default 5)")
+    parser.add_argument('--synthetic', type=int, metavar='N', help="Time one generated book with N pages and N images")
+    parser.add_argument('--baseline', metavar='REV', help="Also time server.py as of git revision REV")
+    args = parser.parse_args()
+    repeat = args.repeat
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.synthetic:
+            library_root = os.path.join(work_dir, 'library')
+            book_dirs = [build_synthetic_book(library_root, args.synthetic)]
+        else:
+            library_root = None
+            book_dirs = args.books or server.list_book_dirs()
+        if not book_dirs:
+            print(f"No books found in {', '.join(server.LIBRARY_ROOTS)}.")
+            sys.exit(1)
+
+        baseline = load_baseline(args.baseline, work_dir) if args.baseline else None
+
+        print(f"Benchmarking get_book_metadata on {len(book_dirs)} books ({repeat} runs each)...")
+        timings = []
+        baseline_timings = []
+        for book_dir in book_dirs:
+            book_path = os.path.join(library_root, book_dir) if library_root else server.resolve_book_path(book_dir)
+            best, meta = time_best(lambda: server.get_book_metadata(book_dir, book_path=book_path), repeat)
+            timings.append(best)
+            cover = (meta or {}).get('cover') or '-'
+            title = (meta or {}).get('title') or '-'
+            line = f"{best * 1000:8.2f} ms  {book_dir}  |  {title.strip()}  |  {cover}"
+            if baseline:
+                baseline.LIBRARY_FOLDER = os.path.dirname(book_path)
+                old_best, old_meta = time_best(lambda: baseline.get_book_metadata(book_dir), repeat)
+                baseline_timings.append(old_best)
+                same = 'same' if old_meta == meta else f'DIFFERS: {old_meta}'
+                line += f"  |  baseline {old_best * 1000:.2f} ms ({same})"
+            print(line)
+
+    timings.sort()
+    total = sum(timings)
+    print(f"\nTotal (best of {repeat}): {total * 1000:.1f} ms")
+    print(f"Median: {timings[len(timings) // 2] * 1000:.2f} ms  Max: {timings[-1] * 1000:.2f} ms")
+    if baseline_timings:
+        print(f"Baseline {args.baseline} total: {sum(baseline_timings) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
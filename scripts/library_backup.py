@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+
+# Run from the project root (the server's working directory):
+#   python scripts/library_backup.py export -o backup.tar [book_dir ...]
+#   python scripts/library_backup.py import backup.tar [--workers N]
+# Use "-" as the file to stream through stdout/stdin, e.g. over ssh:
+#   python scripts/library_backup.py export | ssh host 'cd epub-server && python scripts/library_backup.py import -'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+
+def export_library(book_dirs, output):
+    if not book_dirs:
+        book_dirs = server.list_book_dirs()
+    for book_dir in book_dirs:
+        if not server.is_valid_book_dir(book_dir):
+            print(f"Invalid book directory: {book_dir}", file=sys.stderr)
+            sys.exit(1)
+
+    out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for chunk in server.iter_library_archive(book_dirs):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"Exported {len(book_dirs)} books.", file=sys.stderr)
+
+
+def import_library(source, workers):
+    src = sys.stdin.buffer if source == '-' else open(source, 'rb')
+    try:
+        result = server.restore_library_archive(src, [], workers=workers)
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+    print(f"Restored: {', '.join(result['restored']) or '-'}", file=sys.stderr)
+    if result['skipped']:
+        print(f"Skipped (already present): {', '.join(result['skipped'])}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the library to/from a tar archive.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_export = sub.add_parser('export', help="Write books + metadata snapshot as tar")
+    p_export.add_argument('books', nargs='*', help="Book directories (default: whole library)")
+    p_export.add_argument('-o', '--output', default='-', help="Output file, '-' for stdout (default)")
+
+    p_import = sub.add_parser('import', help="Restore books + metadata from a tar")
+    p_import.add_argument('source', help="Archive file, '-' for stdin")
+    p_import.add_argument('--workers', type=int, default=server.BACKUP_RESTORE_WORKERS)
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_library(args.books, args.output)
+    else:
+        import_library(args.source, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,50 @@
 import os
+import base64
+import errno
+import bisect
+import posixpath
 import shutil
+import stat
+import tarfile
+import collections
+import concurrent.futures
 import zipfile
+import gzip
 import re
 import uuid
 import glob
 import json
+import hashlib
+import hmac
+import functools
+import contextvars
+import cProfile
 import threading
 import time
+import types
 import mimetypes
 from urllib.parse import unquote
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from werkzeug.security import safe_join
 from bs4 import BeautifulSoup
+from lxml import etree
+
+try:
+    from PIL import Image  # Optional: enables import-time image variants
+except ImportError:
+    Image = None
+
+try:
+    from fontTools import subset as font_subset  # Optional: enables font subsetting
+except ImportError:
+    font_subset = None
+
+try:
+    import brotli  # Optional: fontTools needs it to write WOFF2; also used for cached static files
+    FONT_SUBSET_FLAVOR = 'woff2'
+except ImportError:
+    brotli = None
+    FONT_SUBSET_FLAVOR = 'woff'
 
 app = Flask(__name__)
 mimetypes.add_type('application/manifest+json', '.webmanifest')
@@ -18,7 +52,7 @@ mimetypes.add_type('application/manifest+json', '.webmanifest')
 UPLOAD_FOLDER = 'temp_uploads'
 LIBRARY_FOLDER = 'library'
 USER_METADATA_FILE = 'user_metadata.json'
-IGNORE_DIRS = {'.git', '.venv', 'css', 'js', 'scripts', 'temp_uploads', '__pycache__', 'library'}
+IGNORE_DIRS = {'.git', '.venv', 'css', 'js', 'scripts', 'tests', 'temp_uploads', '__pycache__', 'library'}
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -26,16 +60,477 @@ if not os.path.exists(UPLOAD_FOLDER):
 if not os.path.exists(LIBRARY_FOLDER):
     os.makedirs(LIBRARY_FOLDER)
 
-# --- Book Metadata Cache (avoid re-parsing OPFs on every /api/books) ---
-BOOKS_META_CACHE = {}
-BOOKS_META_CACHE_LOCK = threading.Lock()
+# --- Library roots (several disks/mounts, one merged library) ---
+
+# Extra roots come from EPUB_LIBRARY_ROOTS (separated by os.pathsep). Point
+# each at a directory *inside* its mount, so an unmounted disk shows up as a
+# missing root rather than an empty one. Book ids are directory names and are
+# unique across roots; if the same name exists twice, the earlier root wins.
+LIBRARY_ROOTS = list(dict.fromkeys(
+    os.path.normpath(p) for p in [LIBRARY_FOLDER] + os.environ.get('EPUB_LIBRARY_ROOTS', '').split(os.pathsep) if p
+))
+LIBRARY_PLACEMENT_POLICY = 'most_free'  # or 'ordered': first root with LIBRARY_MIN_FREE_BYTES to spare
+LIBRARY_MIN_FREE_BYTES = 1024 * 1024 * 1024
+LIBRARY_RESCAN_SECONDS = 30  # /api/books rescans the roots (for books copied in by hand) at most this often
+# Book ids last seen on each root, kept in the primary root so that a root
+# which is offline when the server starts still holds on to its ids.
+LIBRARY_ROOT_INDEX_FILE = os.path.join(LIBRARY_FOLDER, '.library-roots.json')
+
+# --- Library snapshot (lock-free reads, atomic swaps) ---
+
+# The library view (which books exist, on which root, with their listing
+# metadata) is an immutable LibrarySnapshot. Readers just grab the current
+# one; writers (scan, publish, delete) build a new one under
+# _LIBRARY_WRITE_LOCK and swap it in with a single assignment.
+BookEntry = collections.namedtuple('BookEntry', 'root available meta')
+
+class LibrarySnapshot:
+    __slots__ = ('books', 'root_books', 'scanned_at')
+
+    def __init__(self, books, root_books, scanned_at):
+        self.books = types.MappingProxyType(books)  # book_dir -> BookEntry, in root order
+        self.root_books = types.MappingProxyType(root_books)  # root -> frozenset of book dirs last seen there
+        self.scanned_at = scanned_at  # 0 until the first full scan
+
+_LIBRARY = {'snapshot': LibrarySnapshot({}, {}, 0)}
+_LIBRARY_WRITE_LOCK = threading.Lock()
+_RESERVED_BOOK_DIRS = set()  # names of imports/restores still being staged
+
+def library_snapshot():
+    return _LIBRARY['snapshot']
+
+def _swap_library(books, root_books, scanned_at=None):
+    # Caller holds _LIBRARY_WRITE_LOCK.
+    if scanned_at is None:
+        scanned_at = _LIBRARY['snapshot'].scanned_at
+    _LIBRARY['snapshot'] = LibrarySnapshot(books, root_books, scanned_at)
+
+def is_book_dir_name(name):
+    if not name or name.startswith('.') or name in IGNORE_DIRS:
+        return False
+    return '..' not in name and '/' not in name and '\\' not in name
+
+def load_root_index():
+    """Returns {root: frozenset of book dirs} from LIBRARY_ROOT_INDEX_FILE, for configured roots."""
+    try:
+        with open(LIBRARY_ROOT_INDEX_FILE, 'r', encoding='utf-8') as f:
+            roots = json.load(f).get('roots', {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error loading library root index: {e}")
+        return {}
+    return {
+        root: frozenset(book_dir for book_dir in roots[root] if is_book_dir_name(book_dir))
+        for root in LIBRARY_ROOTS if isinstance(roots.get(root), list)
+    }
+
+_ROOT_INDEX_LOCK = threading.Lock()
+_ROOT_INDEX = {'saved': None}
 
-def invalidate_books_meta_cache(book_dir=None):
-    with BOOKS_META_CACHE_LOCK:
-        if book_dir:
-            BOOKS_META_CACHE.pop(book_dir, None)
+def save_root_index():
+    """Writes the current snapshot's root -> book ids map, if it changed since the last write."""
+    with _ROOT_INDEX_LOCK:
+        roots = {root: sorted(book_dirs) for root, book_dirs in library_snapshot().root_books.items()}
+        if roots == _ROOT_INDEX['saved']:
+            return
+        tmp_path = f"{LIBRARY_ROOT_INDEX_FILE}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'roots': roots}, f, ensure_ascii=False)
+            os.replace(tmp_path, LIBRARY_ROOT_INDEX_FILE)
+            _ROOT_INDEX['saved'] = roots
+        except Exception as e:
+            print(f"Error saving library root index: {e}")
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+
+def _seed_library():
+    # Until the first scan, every recorded id is known but unavailable, so an
+    # import can't take the id of a book on a root that is still offline.
+    root_books = load_root_index()
+    books = {}
+    for root in LIBRARY_ROOTS:
+        for book_dir in sorted(root_books.get(root, ())):
+            books.setdefault(book_dir, BookEntry(root, False, None))
+    _ROOT_INDEX['saved'] = {root: sorted(book_dirs) for root, book_dirs in root_books.items()}
+    _LIBRARY['snapshot'] = LibrarySnapshot(books, root_books, 0)
+
+_seed_library()
+
+def find_book_root(book_dir, verify=True):
+    """Returns the root holding book_dir, or None. verify=False trusts the snapshot."""
+    entry = library_snapshot().books.get(book_dir)
+    if entry is not None and entry.available and (not verify or os.path.isdir(os.path.join(entry.root, book_dir))):
+        return entry.root
+    # Not published yet (e.g. copied in by hand since the last scan).
+    for root in LIBRARY_ROOTS:
+        if os.path.isdir(os.path.join(root, book_dir)):
+            return root
+    return None
+
+def resolve_book_path(book_dir):
+    root = find_book_root(book_dir) if is_book_dir_name(book_dir) else None
+    return os.path.join(root, book_dir) if root else None
+
+def book_dir_taken(book_dir):
+    """True if any root has book_dir, including unavailable roots and names reserved by running imports."""
+    return (
+        book_dir in _RESERVED_BOOK_DIRS
+        or book_dir in library_snapshot().books
+        or find_book_root(book_dir) is not None
+    )
+
+def reserve_book_dir(book_dir, allow_rename=True):
+    """
+    Claims a book id for an import/restore until release_book_dir(). If the
+    name is taken, returns a suffixed one (or None when allow_rename=False).
+    """
+    with _LIBRARY_WRITE_LOCK:
+        if book_dir_taken(book_dir):
+            if not allow_rename:
+                return None
+            book_dir += "_" + str(uuid.uuid4())[:8]
+        _RESERVED_BOOK_DIRS.add(book_dir)
+        return book_dir
+
+def release_book_dir(book_dir):
+    with _LIBRARY_WRITE_LOCK:
+        _RESERVED_BOOK_DIRS.discard(book_dir)
+
+def staging_path_for(root, book_dir, kind='import'):
+    # Hidden (dot-prefixed), so scans skip it and serve_static refuses it until it is published.
+    return os.path.join(root, f".{kind}-{uuid.uuid4().hex[:8]}-{book_dir}")
+
+def staging_book_dir(name):
+    """The book id a staging dir name (from staging_path_for) was created for."""
+    parts = name.split('-', 2)
+    return parts[2] if len(parts) == 3 else None
+
+def load_listing_metadata(book_dir, book_path=None):
+    meta = get_book_metadata(book_dir, book_path)
+    if meta:
+        # Ignore EPUB-provided subjects; user categories are merged in api_books.
+        meta['subjects'] = []
+    return meta
+
+def publish_book(staging_path, book_dir):
+    """
+    Moves a fully processed book from its staging dir into place with one
+    atomic rename and swaps in a snapshot that includes it. book_dir must be
+    reserved. Returns the final path.
+    """
+    root = os.path.dirname(staging_path)
+    final_path = os.path.join(root, book_dir)
+    os.rename(staging_path, final_path)
+    meta = load_listing_metadata(book_dir, final_path)
+    with _LIBRARY_WRITE_LOCK:
+        snapshot = library_snapshot()
+        books = dict(snapshot.books)
+        books[book_dir] = BookEntry(root, True, meta)
+        root_books = dict(snapshot.root_books)
+        root_books[root] = root_books.get(root, frozenset()) | {book_dir}
+        _swap_library(books, root_books)
+    save_root_index()
+    return final_path
+
+def unpublish_book(book_dir):
+    """Swaps in a snapshot without book_dir (after it was deleted)."""
+    with _LIBRARY_WRITE_LOCK:
+        snapshot = library_snapshot()
+        entry = snapshot.books.get(book_dir)
+        if entry is None:
+            return
+        books = {d: e for d, e in snapshot.books.items() if d != book_dir}
+        root_books = dict(snapshot.root_books)
+        root_books[entry.root] = root_books.get(entry.root, frozenset()) - {book_dir}
+        _swap_library(books, root_books)
+    save_root_index()
+
+def choose_library_root(min_free=0):
+    """Picks the root for a new book according to LIBRARY_PLACEMENT_POLICY."""
+    candidates = []
+    for root in LIBRARY_ROOTS:
+        try:
+            free = shutil.disk_usage(root).free
+        except OSError:
+            continue  # unavailable
+        if free >= min_free:
+            candidates.append((root, free))
+    if not candidates:
+        return LIBRARY_FOLDER
+    if LIBRARY_PLACEMENT_POLICY == 'ordered':
+        roomy = [root for root, free in candidates if free >= LIBRARY_MIN_FREE_BYTES + min_free]
+        return roomy[0] if roomy else max(candidates, key=lambda c: c[1])[0]
+    return max(candidates, key=lambda c: c[1])[0]
+
+def _list_root(root):
+    try:
+        return [entry for entry in os.listdir(root) if is_book_dir_name(entry) and os.path.isdir(os.path.join(root, entry))]
+    except OSError:
+        return None
+
+def _load_root_metadata(root, book_dirs):
+    return {book_dir: load_listing_metadata(book_dir, os.path.join(root, book_dir)) for book_dir in book_dirs}
+
+def scan_library():
+    """
+    Lists every root in parallel and swaps in a fresh snapshot. A root that
+    can't be listed keeps its last known books (available=False), so their
+    ids don't disappear or get reused; the ids are persisted in
+    LIBRARY_ROOT_INDEX_FILE so this survives restarts. Metadata is carried over from the
+    previous snapshot; books new to it are loaded in parallel, one worker per
+    root, before the swap. Returns the new snapshot.
+    """
+    # Taken before listing: anything published or deleted after this point
+    # is reconciled against the listing under the write lock below.
+    previous = library_snapshot()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(LIBRARY_ROOTS)) as pool:
+        listings = list(pool.map(_list_root, LIBRARY_ROOTS))
+
+    found = {}  # book_dir -> (root, available), earlier roots win
+    root_books = {}
+    for root, book_dirs in zip(LIBRARY_ROOTS, listings):
+        available = book_dirs is not None
+        if available:
+            root_books[root] = frozenset(book_dirs)
         else:
-            BOOKS_META_CACHE.clear()
+            print(f"Library root unavailable: {root}")
+            root_books[root] = previous.root_books.get(root, frozenset())
+        for book_dir in (book_dirs if available else sorted(root_books[root])):
+            found.setdefault(book_dir, (root, available))
+
+    def carried_meta(snapshot, book_dir, root):
+        entry = snapshot.books.get(book_dir)
+        return entry.meta if entry is not None and entry.root == root else None
+
+    loaded = {}
+    missing = {}
+    for book_dir, (root, available) in found.items():
+        if available and carried_meta(previous, book_dir, root) is None:
+            missing.setdefault(root, []).append(book_dir)
+    if missing:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(missing)) as pool:
+            for metas in pool.map(_load_root_metadata, missing.keys(), missing.values()):
+                loaded.update(metas)
+
+    with _LIBRARY_WRITE_LOCK:
+        # Publishes/deletes that landed while we were listing win over the listing.
+        current = library_snapshot()
+        books = {}
+        for book_dir, (root, available) in found.items():
+            if book_dir in previous.books and book_dir not in current.books:
+                root_books[root] = root_books[root] - {book_dir}  # deleted meanwhile
+                continue
+            meta = loaded.get(book_dir) or carried_meta(current, book_dir, root)
+            books[book_dir] = BookEntry(root, available, meta)
+        for book_dir, entry in current.books.items():
+            if book_dir not in previous.books and book_dir not in books:
+                books[book_dir] = entry  # published meanwhile
+                root_books[entry.root] = root_books.get(entry.root, frozenset()) | {book_dir}
+        _swap_library(books, root_books, time.time())
+    save_root_index()
+    return library_snapshot()
+
+_LIBRARY_SCAN_LOCK = threading.Lock()  # one opportunistic rescan at a time; readers never wait on it
+
+def _rescan_in_background():
+    try:
+        scan_library()
+    except Exception as e:
+        print(f"Error rescanning library: {e}")
+    finally:
+        _LIBRARY_SCAN_LOCK.release()
+
+def current_library():
+    """
+    Returns the library snapshot. If it is older than LIBRARY_RESCAN_SECONDS,
+    a rescan is started on a background thread and the current snapshot is
+    returned right away; only the very first scan runs inline.
+    """
+    snapshot = library_snapshot()
+    if not snapshot.scanned_at:
+        with _LIBRARY_SCAN_LOCK:
+            snapshot = library_snapshot()
+            return snapshot if snapshot.scanned_at else scan_library()
+    if time.time() - snapshot.scanned_at > LIBRARY_RESCAN_SECONDS and _LIBRARY_SCAN_LOCK.acquire(blocking=False):
+        try:
+            threading.Thread(target=_rescan_in_background, daemon=True).start()
+        except Exception:
+            _LIBRARY_SCAN_LOCK.release()
+            raise
+    return snapshot
+
+def list_book_dirs():
+    """Sorted ids of all books on available roots."""
+    return sorted(book_dir for book_dir, entry in scan_library().books.items() if entry.available)
+
+# --- Request Tracing & Profiling (opt-in) ---
+
+# Per-span timings are collected for every request/import while a trace is
+# active and logged as one JSON line when it is slow. Set the thresholds to
+# None to disable tracing entirely (spans then cost a single context-variable
+# lookup). The spans go out in a Server-Timing header on profiled requests,
+# or on every traced request when SERVER_TIMING_ENABLED is set; it is off by
+# default so internal timings are not exposed to every client.
+SLOW_REQUEST_THRESHOLD_MS = 1000
+SLOW_IMPORT_THRESHOLD_MS = 30000
+SERVER_TIMING_ENABLED = os.environ.get('EPUB_SERVER_TIMING', '') == '1'
+# cProfile output (.prof, pstats format) is written for request paths listed
+# here, or for any request/import carrying ?profile=<profile_signature(path)>.
+PROFILE_PATHS = set()
+PROFILE_SECRET = os.environ.get('EPUB_PROFILE_SECRET', '')
+PROFILE_OUTPUT_FOLDER = 'profiles'
+PROFILE_LOCK = threading.Lock()  # cProfile can only run one profile at a time on 3.12+
+
+_CURRENT_TRACE = contextvars.ContextVar('epub_trace', default=None)
+
+class RequestTrace:
+    def __init__(self, label):
+        self.label = label
+        self.start = time.perf_counter()
+        self.spans = {}  # name -> [count, seconds]; nested spans overlap
+
+    def add(self, name, elapsed):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [1, elapsed]
+        else:
+            span[0] += 1
+            span[1] += elapsed
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        parts = [f'{name};dur={seconds * 1000:.1f};desc="x{count}"' for name, (count, seconds) in self.spans.items()]
+        parts.append(f'total;dur={self.elapsed_ms():.1f}')
+        return ', '.join(parts)
+
+    def log_if_slow(self, threshold_ms, **fields):
+        total_ms = self.elapsed_ms()
+        if threshold_ms is None or total_ms < threshold_ms:
+            return
+        record = {
+            'event': 'slow_request',
+            'label': self.label,
+            'total_ms': round(total_ms, 1),
+            'spans': {name: {'count': count, 'ms': round(seconds * 1000, 1)} for name, (count, seconds) in self.spans.items()},
+            **fields,
+        }
+        print(json.dumps(record, ensure_ascii=False))
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+
+class _NoopSpan:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def trace_span(name):
+    trace = _CURRENT_TRACE.get()
+    return _NOOP_SPAN if trace is None else _Span(trace, name)
+
+def traced(name):
+    """Decorator: records the wrapped function as span `name` of the active trace."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _CURRENT_TRACE.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def profile_signature(path):
+    """Value for ?profile= that enables profiling of `path` (requires EPUB_PROFILE_SECRET)."""
+    return hmac.new(PROFILE_SECRET.encode('utf-8'), path.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def profile_requested(path, flag):
+    if path in PROFILE_PATHS:
+        return True
+    if not (PROFILE_SECRET and flag):
+        return False
+    # Compare bytes: compare_digest rejects non-ASCII str (e.g. ?profile=%C3%A9).
+    return hmac.compare_digest(flag.encode('utf-8'), profile_signature(path).encode('ascii'))
+
+def start_profile(wait_seconds=0):
+    acquired = PROFILE_LOCK.acquire(timeout=wait_seconds) if wait_seconds > 0 else PROFILE_LOCK.acquire(blocking=False)
+    if not acquired:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is active
+        PROFILE_LOCK.release()
+        return None
+    return profiler
+
+def finish_profile(profiler, label):
+    """Stops the profiler and writes its stats. Returns the output path."""
+    try:
+        profiler.disable()
+    finally:
+        PROFILE_LOCK.release()
+    os.makedirs(PROFILE_OUTPUT_FOLDER, exist_ok=True)
+    safe_label = re.sub(r'[^\w\-]+', '_', label).strip('_')[:80] or 'request'
+    out_path = os.path.join(PROFILE_OUTPUT_FOLDER, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_label}-{uuid.uuid4().hex[:6]}.prof")
+    profiler.dump_stats(out_path)
+    print(f"Profile written: {out_path}")
+    return out_path
+
+@app.before_request
+def _start_request_trace():
+    profiling = profile_requested(request.path, request.args.get('profile'))
+    if SLOW_REQUEST_THRESHOLD_MS is None and not profiling:
+        return
+    g.trace = RequestTrace(f"{request.method} {request.path}")
+    g.trace_token = _CURRENT_TRACE.set(g.trace)
+    g.profiler = start_profile() if profiling else None
+
+@app.after_request
+def _finish_request_trace(response):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-File'] = finish_profile(profiler, trace.label)
+    if profiler is not None or SERVER_TIMING_ENABLED:
+        response.headers['Server-Timing'] = trace.server_timing()
+    trace.log_if_slow(SLOW_REQUEST_THRESHOLD_MS, status=response.status_code)
+    return response
+
+@app.teardown_request
+def _reset_request_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        _CURRENT_TRACE.reset(token)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:  # after_request was skipped by an error
+        finish_profile(profiler, request.path)
 
 # --- Upload Task Tracking (for progress / logs) ---
 UPLOAD_TASKS = {}
@@ -66,83 +561,71 @@ def _task_update(task_id, **fields):
         task.update(fields)
         task['updated_at'] = time.time()
 
-def _process_upload_task(task_id, filepath, filename, categories):
-    extract_path = None
-    try:
-        class TaskLogs:
-            def __init__(self, task_id):
-                self._task_id = task_id
-            def append(self, message):
-                with UPLOAD_TASKS_LOCK:
-                    task = UPLOAD_TASKS.get(self._task_id)
-                    if not task:
-                        return
-                    task['logs'].append(message)
-                    task['updated_at'] = time.time()
-
-        task_logs = TaskLogs(task_id)
-
-        _task_update(task_id, status='running', progress={'phase': 'received', 'current': 0, 'total': 0})
-        _task_append_log(task_id, f"File uploaded: {filename}")
-
-        # 1. Unzip
-        book_name_safe = os.path.splitext(filename)[0]
-        book_name_safe = re.sub(r'[^\w\-\u4e00-\u9fa5]', '_', book_name_safe)
-        extract_path = os.path.join(LIBRARY_FOLDER, book_name_safe)
-
-        # Handle collision
-        if os.path.exists(extract_path):
-            extract_path += "_" + str(uuid.uuid4())[:8]
-
-        _task_update(task_id, progress={'phase': 'extracting', 'current': 0, 'total': 0})
-        _task_append_log(task_id, f"Extracting to: {extract_path}")
-
-        with zipfile.ZipFile(filepath, 'r') as zip_ref:
-            zip_ref.extractall(extract_path)
-
-        _task_append_log(task_id, "Extraction complete.")
-
-        # 2. Process Files
-        # Collect files to process so we can provide progress.
-        files_to_process = []
-        for root, dirs, files in os.walk(extract_path):
-            for file in files:
-                if file.lower().endswith(('.css', '.html', '.xhtml')):
-                    files_to_process.append(os.path.join(root, file))
-
-        total = len(files_to_process)
-        processed = 0
-        _task_update(task_id, progress={'phase': 'processing', 'current': processed, 'total': total})
-        _task_append_log(task_id, f"Processing files: {total}")
+def _process_upload_task(task_id, filepath, filename, categories, profile=False):
+    # Runs on its own thread, so it gets its own trace (and profile, if requested).
+    if SLOW_IMPORT_THRESHOLD_MS is None and not profile:
+        _run_upload_task(task_id, filepath, filename, categories)
+        return
 
-        for full_path in files_to_process:
-            name = os.path.basename(full_path)
-            lower = name.lower()
-
-            if lower.endswith('.css'):
-                convert_css_vertical_to_horizontal(full_path, task_logs)
+    trace = RequestTrace(f"import {filename}")
+    token = _CURRENT_TRACE.set(trace)
+    # The upload request may itself be profiled; wait for it to finish.
+    profiler = start_profile(wait_seconds=10) if profile else None
+    try:
+        _run_upload_task(task_id, filepath, filename, categories)
+    finally:
+        _CURRENT_TRACE.reset(token)
+        if profiler is not None:
+            _task_append_log(task_id, f"Profile written: {finish_profile(profiler, trace.label)}")
+        trace.log_if_slow(SLOW_IMPORT_THRESHOLD_MS, task_id=task_id)
+
+def import_book_archive(source, filename, logs, on_progress=None, categories=None):
+    """Import one uploaded .epub/.zip (a path or a seekable file object) and return its book dir.
+
+    Every import stage runs here, for both the async task and the synchronous upload;
+    on_progress(phase, current, total) is called as each phase advances.
+    """
+    # Create a directory name based on filename without extension, with weird chars cleaned
+    book_name_safe = os.path.splitext(filename)[0]
+    book_name_safe = re.sub(r'[^\w\-\u4e00-\u9fa5]', '_', book_name_safe)
+
+    if isinstance(source, str):
+        source_size = os.path.getsize(source)
+    else:
+        source.seek(0, os.SEEK_END)
+        source_size = source.tell()
+        source.seek(0)
+
+    def phase_progress(phase):
+        if on_progress is None:
+            return None
+        return lambda current, total: on_progress(phase, current, total)
 
-            if lower.endswith(('.html', '.xhtml')):
-                convert_css_vertical_to_horizontal(full_path, task_logs)
-                process_html_content(full_path, task_logs)
+    # Handle collision (across all roots and other running imports)
+    book_dir_name = reserve_book_dir(book_name_safe)
+    # Work in a private staging dir; the book only appears once it is complete.
+    staging_path = staging_path_for(choose_library_root(source_size), book_dir_name)
+    try:
+        log(logs, f"Extracting to: {staging_path}")
+        total = extract_book_archive(source, staging_path, logs, on_progress=phase_progress('extracting'))
+        log(logs, "Extraction and content processing complete.")
 
-            processed += 1
-            if processed == total or processed % 10 == 0:
-                _task_update(task_id, progress={'phase': 'processing', 'current': processed, 'total': total})
+        optimize_book_images(staging_path, logs, on_progress=phase_progress('optimizing'))
+        subset_book_fonts(staging_path, logs)
+        dedupe_book_assets(staging_path, logs)
 
-        _task_append_log(task_id, "Content processing complete.")
+        if on_progress is not None:
+            on_progress('indexing', total, total)
+        save_position_index(book_dir_name, logs, book_path=staging_path)
 
-        # Cleanup Upload
-        try:
-            os.remove(filepath)
-        except Exception:
-            pass
+        publish_book(staging_path, book_dir_name)
+        staging_path = None
 
-        # 3. Save Metadata (Categories) if provided
-        _task_update(task_id, progress={'phase': 'finalizing', 'current': processed, 'total': total})
+        # Save Metadata (Categories) if provided, avoiding duplicates
+        if on_progress is not None:
+            on_progress('finalizing', total, total)
         if categories:
             user_meta = load_user_metadata()
-            book_dir_name = os.path.basename(extract_path)
             if book_dir_name not in user_meta:
                 user_meta[book_dir_name] = {}
 
@@ -153,25 +636,57 @@ def _process_upload_task(task_id, filepath, filename, categories):
                     current_cats.append(cat)
 
             user_meta[book_dir_name]['categories'] = current_cats
-            save_user_metadata(user_meta)
-            _task_append_log(task_id, f"Added categories: {', '.join(categories)}")
+            save_user_metadata(user_meta, changed_books=[book_dir_name])
+            log(logs, f"Added categories: {', '.join(categories)}")
+        return book_dir_name
+    except Exception:
+        if staging_path and os.path.isdir(staging_path):
+            shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+    finally:
+        release_book_dir(book_dir_name)
+
+def _run_upload_task(task_id, filepath, filename, categories):
+    class TaskLogs:
+        def __init__(self, task_id):
+            self._task_id = task_id
+        def append(self, message):
+            with UPLOAD_TASKS_LOCK:
+                task = UPLOAD_TASKS.get(self._task_id)
+                if not task:
+                    return
+                task['logs'].append(message)
+                task['updated_at'] = time.time()
+
+    seen = {'total': 0}
+
+    def on_progress(phase, current, total):
+        seen['total'] = total
+        if current == total or current % 10 == 0:
+            _task_update(task_id, progress={'phase': phase, 'current': current, 'total': total})
 
-        book_dir_name = os.path.basename(extract_path)
+    _task_update(task_id, status='running', progress={'phase': 'received', 'current': 0, 'total': 0})
+    _task_append_log(task_id, f"File uploaded: {filename}")
+    try:
+        book_dir_name = import_book_archive(
+            filepath, filename, TaskLogs(task_id), on_progress=on_progress, categories=categories,
+        )
+        total = seen['total']
         _task_update(
             task_id,
             status='done',
             book_dir=book_dir_name,
             progress={'phase': 'done', 'current': total, 'total': total},
         )
-        invalidate_books_meta_cache(book_dir_name)
         _task_append_log(task_id, "Import finished.")
 
     except Exception as e:
         _task_append_log(task_id, f"Error processing: {e}")
         _task_update(task_id, status='error', error=str(e), progress={'phase': 'error', 'current': 0, 'total': 0})
+    finally:
+        # Cleanup Upload
         try:
-            if filepath and os.path.exists(filepath):
-                os.remove(filepath)
+            os.remove(filepath)
         except Exception:
             pass
 
@@ -202,113 +717,893 @@ def get_script_to_inject():
     }
 """
 
-def process_html_content(filepath, logs):
+@traced('html_rewrite')
+def rewrite_html_text(content):
+    """
+    Cleans titles and injects navigation script into an HTML string.
+    Returns (new_content, modified).
+    """
+    soup = BeautifulSoup(content, 'lxml')
+    modified = False
+
+    # 1. Clean Titles (remove <a> in <p>)
+    for p_tag in soup.find_all('p'):
+        links = p_tag.find_all('a')
+        if links:
+            for a_tag in links:
+                a_tag.unwrap()
+            modified = True
+
+    # 2. Inject Script
+    head = soup.find('head')
+    if head:
+        if "window.location.replace" not in str(head):
+            script_tag = soup.new_tag("script")
+            script_tag.string = get_script_to_inject()
+            head.append(script_tag)
+            modified = True
+
+    return (str(soup) if modified else content), modified
+
+def convert_vertical_text(content):
     """
-    Cleans titles and injects navigation script.
-    Same logic as scripts/process_ebook.py
+    Replaces vertical writing mode with horizontal in a CSS (or HTML) string.
+    Returns (new_content, changes).
     """
+    # Regex patterns for vertical writing modes
+    # Matches: writing-mode: vertical-rl; or -webkit-writing-mode: vertical-rl;
+    # We replace them with horizontal-tb
+    patterns = [
+        (r'(writing-mode\s*:\s*)vertical-rl', r'\1horizontal-tb'),
+        (r'(-webkit-writing-mode\s*:\s*)vertical-rl', r'\1horizontal-tb'),
+        (r'(writing-mode\s*:\s*)vertical-lr', r'\1horizontal-tb'),
+        (r'(-webkit-writing-mode\s*:\s*)vertical-lr', r'\1horizontal-tb'),
+    ]
+
+    changes = 0
+    for pattern, replacement in patterns:
+        content, n = re.subn(pattern, replacement, content, flags=re.IGNORECASE)
+        changes += n
+    return content, changes
+
+# --- Archive Import (streaming, bounded memory) ---
+
+# Limits applied to every uploaded archive before and while it is extracted.
+IMPORT_MAX_TOTAL_BYTES = 4 * 1024 * 1024 * 1024  # uncompressed size of the whole book
+IMPORT_MAX_ENTRIES = 20000
+IMPORT_MAX_COMPRESSION_RATIO = 100
+IMPORT_RATIO_MIN_BYTES = 1024 * 1024  # tiny entries may legitimately compress very well
+IMPORT_MAX_TEXT_ENTRY_BYTES = 16 * 1024 * 1024  # larger CSS/HTML entries are copied as-is
+IMPORT_COPY_CHUNK_SIZE = 1024 * 1024
+
+class ArchiveImportError(ValueError):
+    """Raised when an uploaded archive is unsafe or exceeds the import limits."""
+
+def _safe_entry_relpath(name):
+    name = name.replace('\\', '/')
+    parts = [p for p in name.split('/') if p not in ('', '.')]
+    if not parts or '..' in parts or ':' in parts[0]:
+        return None
+    return os.path.join(*parts)
+
+def _check_archive_limits(infos):
+    if len(infos) > IMPORT_MAX_ENTRIES:
+        raise ArchiveImportError(f"Archive has too many entries ({len(infos)} > {IMPORT_MAX_ENTRIES}).")
+
+    total = 0
+    for info in infos:
+        total += info.file_size
+        if total > IMPORT_MAX_TOTAL_BYTES:
+            raise ArchiveImportError(f"Archive is too large when uncompressed (> {IMPORT_MAX_TOTAL_BYTES} bytes).")
+        if info.file_size >= IMPORT_RATIO_MIN_BYTES:
+            ratio = info.file_size / max(info.compress_size, 1)
+            if ratio > IMPORT_MAX_COMPRESSION_RATIO:
+                raise ArchiveImportError(f"Suspicious compression ratio ({ratio:.0f}:1) for entry: {info.filename}")
+
+def _copy_entry(zip_ref, info, dest_path, budget):
+    """Streams one entry to disk in fixed-size chunks. Returns bytes written."""
+    written = 0
+    with zip_ref.open(info) as src, open(dest_path, 'wb') as dst:
+        while True:
+            chunk = src.read(IMPORT_COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > budget:
+                raise ArchiveImportError(f"Archive is too large when uncompressed (> {IMPORT_MAX_TOTAL_BYTES} bytes).")
+            dst.write(chunk)
+    return written
+
+def _process_text_entry(zip_ref, info, dest_path, logs):
+    """Reads a CSS/HTML entry, rewrites it in memory and writes it once."""
+    raw = zip_ref.read(info)
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = raw.decode('utf-8')
+    except UnicodeDecodeError as e:
+        log(logs, f"Error processing {dest_path}: {e}")
+        content = None
 
-        soup = BeautifulSoup(content, 'lxml')
-        modified = False
+    if content is not None:
+        lower = dest_path.lower()
+        try:
+            content, changes = convert_vertical_text(content)
+            if changes > 0:
+                log(logs, f"Converted {changes} vertical styles in: {os.path.basename(dest_path)}")
+        except Exception as e:
+            log(logs, f"Error converting CSS {dest_path}: {e}")
+        if lower.endswith(('.html', '.xhtml')):
+            try:
+                content, _ = rewrite_html_text(content)
+            except Exception as e:
+                log(logs, f"Error processing HTML {dest_path}: {e}")
+        raw = content.encode('utf-8')
 
-        # 1. Clean Titles (remove <a> in <p>)
-        for p_tag in soup.find_all('p'):
-            links = p_tag.find_all('a')
-            if links:
-                for a_tag in links:
-                    a_tag.unwrap()
-                modified = True
-                
-        # 2. Inject Script
-        head = soup.find('head')
-        if head:
-            if "window.location.replace" not in str(head):
-                script_tag = soup.new_tag("script")
-                script_tag.string = get_script_to_inject()
-                head.append(script_tag)
-                modified = True
-        
-        if modified:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(str(soup))
-            # log(logs, f"Processed HTML: {os.path.basename(filepath)}")
-            
-    except Exception as e:
-        log(logs, f"Error processing HTML {filepath}: {e}")
+    with open(dest_path, 'wb') as f:
+        f.write(raw)
+    return len(raw)
 
-def convert_css_vertical_to_horizontal(filepath, logs):
+@traced('zip_extract')
+def extract_book_archive(filepath, extract_path, logs, on_progress=None):
+    """
+    Extracts an EPUB/zip (a path or a seekable file object) entry by entry
+    into extract_path, processing CSS/HTML entries as they come out. Memory
+    use is bounded by the largest text entry (capped by
+    IMPORT_MAX_TEXT_ENTRY_BYTES), not by the size of the book. Returns the
+    number of entries handled.
     """
-    Reads a CSS (or HTML) file and replaces vertical writing mode with horizontal.
+    with zipfile.ZipFile(filepath, 'r') as zip_ref:
+        infos = zip_ref.infolist()
+        _check_archive_limits(infos)
+
+        total = len(infos)
+        remaining = IMPORT_MAX_TOTAL_BYTES
+        os.makedirs(extract_path, exist_ok=True)
+
+        for index, info in enumerate(infos, start=1):
+            relpath = _safe_entry_relpath(info.filename)
+            if relpath is None:
+                raise ArchiveImportError(f"Unsafe path in archive: {info.filename}")
+            dest_path = os.path.join(extract_path, relpath)
+
+            if info.is_dir():
+                os.makedirs(dest_path, exist_ok=True)
+            else:
+                parent = os.path.dirname(dest_path)
+                if parent:
+                    os.makedirs(parent, exist_ok=True)
+                is_text = dest_path.lower().endswith(('.css', '.html', '.xhtml'))
+                if is_text and info.file_size <= IMPORT_MAX_TEXT_ENTRY_BYTES:
+                    remaining -= _process_text_entry(zip_ref, info, dest_path, logs)
+                else:
+                    if is_text:
+                        log(logs, f"Skipping processing of large file: {os.path.basename(dest_path)}")
+                    remaining -= _copy_entry(zip_ref, info, dest_path, remaining)
+                if remaining < 0:
+                    raise ArchiveImportError(f"Archive is too large when uncompressed (> {IMPORT_MAX_TOTAL_BYTES} bytes).")
+
+            if on_progress:
+                on_progress(index, total)
+
+    return total
+
+# --- Content Image Variants (optional, requires Pillow) ---
+
+# Oversized raster images are re-encoded to WebP at a few widths next to the
+# original (e.g. p001.png -> p001.960w.webp) and chapters get srcset/sizes.
+# The original files are never modified.
+IMAGE_VARIANTS_ENABLED = True
+IMAGE_VARIANT_WIDTHS = (480, 960, 1440)
+IMAGE_VARIANT_MIN_BYTES = 150 * 1024
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_SIZES = '(max-width: 1440px) 100vw, 1440px'
+IMAGE_VARIANT_SOURCE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+def _variant_path(image_path, width):
+    return f"{os.path.splitext(image_path)[0]}.{width}w.webp"
+
+def _build_image_variants(image_path):
+    """
+    Writes WebP variants for one image. Returns [(width, variant_path), ...]
+    sorted by width, or [] if the image is small or re-encoding doesn't help.
     """
+    original_size = os.path.getsize(image_path)
+    with Image.open(image_path) as im:
+        orig_w, orig_h = im.size
+        largest = max(IMAGE_VARIANT_WIDTHS)
+        if original_size < IMAGE_VARIANT_MIN_BYTES and orig_w <= largest:
+            return []
+
+        targets = sorted({w for w in IMAGE_VARIANT_WIDTHS if w < orig_w} | {min(orig_w, largest)})
+        has_alpha = im.mode in ('RGBA', 'LA', 'PA') or (im.mode == 'P' and 'transparency' in im.info)
+        im = im.convert('RGBA' if has_alpha else 'RGB')
+
+        variants = []
+        for width in targets:
+            out_path = _variant_path(image_path, width)
+            if not (os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(image_path)):
+                height = max(1, round(orig_h * width / orig_w))
+                resized = im if width == orig_w else im.resize((width, height), Image.LANCZOS)
+                # Write then rename: the old variant may be a hard link into the blob store.
+                tmp_path = f"{out_path}.tmp"
+                resized.save(tmp_path, 'WEBP', quality=IMAGE_VARIANT_QUALITY, method=4)
+                os.replace(tmp_path, out_path)
+            variants.append((width, out_path))
+
+    # Keep variants only if the largest one actually saves bytes.
+    if os.path.getsize(variants[-1][1]) >= original_size:
+        for _, out_path in variants:
+            os.remove(out_path)
+        return []
+    return variants
+
+def _rewrite_chapter_images(html_path, variants_by_path, logs):
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
+        with open(html_path, 'r', encoding='utf-8') as f:
             content = f.read()
+    except Exception as e:
+        log(logs, f"Error reading {html_path}: {e}")
+        return False
 
-        # Regex patterns for vertical writing modes
-        # Matches: writing-mode: vertical-rl; or -webkit-writing-mode: vertical-rl;
-        # We replace them with horizontal-tb
-        
-        new_content = content
-        
-        patterns = [
-            (r'(writing-mode\s*:\s*)vertical-rl', r'\1horizontal-tb'),
-            (r'(-webkit-writing-mode\s*:\s*)vertical-rl', r'\1horizontal-tb'),
-            (r'(writing-mode\s*:\s*)vertical-lr', r'\1horizontal-tb'),
-            (r'(-webkit-writing-mode\s*:\s*)vertical-lr', r'\1horizontal-tb'),
-        ]
+    html_dir = os.path.dirname(html_path)
+
+    def lookup(href):
+        href = unquote((href or '').split('#', 1)[0].split('?', 1)[0]).strip()
+        if not href or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', href) or href.startswith('/'):
+            return None
+        full_path = os.path.normpath(os.path.join(html_dir, href))
+        return variants_by_path.get(full_path)
+
+    def rel(path):
+        return os.path.relpath(path, html_dir).replace(os.sep, '/')
+
+    soup = BeautifulSoup(content, 'lxml')
+    modified = False
+
+    for img in soup.find_all('img'):
+        variants = lookup(img.get('src'))
+        if not variants or img.get('srcset'):
+            continue
+        img['srcset'] = ', '.join(f"{rel(path)} {width}w" for width, path in variants)
+        img['sizes'] = IMAGE_VARIANT_SIZES
+        modified = True
+
+    # SVG <image> has no srcset; point it at the largest variant instead.
+    for svg_image in soup.find_all('image'):
+        for attr in ('xlink:href', 'href'):
+            variants = lookup(svg_image.get(attr))
+            if variants:
+                svg_image[attr] = rel(variants[-1][1])
+                modified = True
 
-        changes = 0
-        for pattern, replacement in patterns:
-            new_content, n = re.subn(pattern, replacement, new_content, flags=re.IGNORECASE)
-            changes += n
+    if modified:
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(str(soup))
+    return modified
 
-        if changes > 0:
-            with open(filepath, 'w', encoding='utf-8') as f:
+@traced('image_variants')
+def optimize_book_images(book_path, logs, on_progress=None):
+    """
+    Generates responsive WebP variants for oversized images in an extracted
+    book and adds srcset/sizes to the chapters that reference them.
+    No-op when disabled or when Pillow is not installed.
+    """
+    if not IMAGE_VARIANTS_ENABLED or Image is None:
+        return 0
+
+    images = []
+    html_files = []
+    for root, dirs, files in os.walk(book_path):
+        for file in files:
+            lower = file.lower()
+            full_path = os.path.join(root, file)
+            if lower.endswith(IMAGE_VARIANT_SOURCE_EXTS):
+                images.append(full_path)
+            elif lower.endswith(('.html', '.xhtml')):
+                html_files.append(full_path)
+
+    variants_by_path = {}
+    total = len(images)
+    for index, image_path in enumerate(images, start=1):
+        try:
+            variants = _build_image_variants(image_path)
+        except Exception as e:
+            log(logs, f"Error optimizing image {os.path.basename(image_path)}: {e}")
+            variants = []
+        if variants:
+            variants_by_path[os.path.normpath(image_path)] = variants
+        if on_progress:
+            on_progress(index, total)
+
+    if not variants_by_path:
+        return 0
+
+    rewritten = sum(1 for html_path in html_files if _rewrite_chapter_images(html_path, variants_by_path, logs))
+    log(logs, f"Optimized {len(variants_by_path)} images, updated {rewritten} chapters.")
+    return len(variants_by_path)
+
+# --- Embedded font subsetting (optional, requires fontTools) ---
+
+# Large embedded fonts referenced from @font-face are cut down to the code
+# points the book actually uses and re-encoded as WOFF2 next to the
+# original (e.g. song.ttf -> song.subset.woff2); the @font-face url() is
+# rewritten. Originals are kept and .font-subsets.json maps each subset
+# back to its original so a re-run subsets from the full font again.
+FONT_SUBSET_ENABLED = True
+FONT_SUBSET_MIN_BYTES = 256 * 1024
+FONT_SUBSET_MANIFEST_FILE = '.font-subsets.json'
+FONT_SOURCE_EXTS = ('.ttf', '.otf', '.woff', '.woff2')
+FONT_FACE_RE = re.compile(r'@font-face\s*\{[^}]*\}', re.IGNORECASE)
+# url(...) optionally followed by its format(...) hint
+FONT_SRC_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)(\s*format\(\s*[\'"]?[^\'")]*[\'"]?\s*\))?', re.IGNORECASE)
+
+def _collect_book_codepoints(html_files, css_files):
+    """Every character used in the book's markup (plus CSS, for content: strings) and printable ASCII."""
+    codepoints = set(range(0x20, 0x7f))
+    parser = etree.HTMLParser(encoding='utf-8')
+    for path in html_files:
+        try:
+            with open(path, 'rb') as f:
+                root = etree.fromstring(f.read(), parser)
+        except Exception:
+            continue
+        if root is None:
+            continue
+        for text in root.itertext():
+            codepoints.update(map(ord, text))
+        for el in root.iter():
+            for attr in ('alt', 'title'):
+                value = el.get(attr) if isinstance(el.tag, str) else None
+                if value:
+                    codepoints.update(map(ord, value))
+    for path in css_files:
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                codepoints.update(map(ord, f.read()))
+        except Exception:
+            continue
+    return {cp for cp in codepoints if not 0xd800 <= cp <= 0xdfff}
+
+def _subset_font(source_path, out_path, codepoints):
+    options = font_subset.Options()
+    options.flavor = FONT_SUBSET_FLAVOR
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    font = font_subset.load_font(source_path, options)
+    try:
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        tmp_path = f"{out_path}.tmp"
+        font_subset.save_font(font, tmp_path, options)
+        os.replace(tmp_path, out_path)
+    finally:
+        font.close()
+
+@traced('font_subset')
+def subset_book_fonts(book_path, logs):
+    """
+    Subsets large fonts referenced from @font-face rules in the book's CSS
+    (and inline <style>) to the characters the book uses.
+    No-op when disabled or when fontTools is not installed.
+    """
+    if not FONT_SUBSET_ENABLED or font_subset is None:
+        return 0
+
+    css_files, html_files = [], []
+    for root, dirs, files in os.walk(book_path):
+        for file in files:
+            lower = file.lower()
+            if lower.endswith('.css'):
+                css_files.append(os.path.join(root, file))
+            elif lower.endswith(('.html', '.xhtml')):
+                html_files.append(os.path.join(root, file))
+
+    manifest_path = os.path.join(book_path, FONT_SUBSET_MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except Exception:
+        manifest = {}
+
+    codepoints = None
+    subsets = {}  # original font path -> subset path (None if not worth it)
+
+    def subset_for(font_path):
+        nonlocal codepoints
+        if font_path not in subsets:
+            subsets[font_path] = None
+            if os.path.getsize(font_path) >= FONT_SUBSET_MIN_BYTES:
+                if codepoints is None:
+                    codepoints = _collect_book_codepoints(html_files, css_files)
+                out_path = f"{os.path.splitext(font_path)[0]}.subset.{FONT_SUBSET_FLAVOR}"
+                try:
+                    _subset_font(font_path, out_path, codepoints)
+                    if os.path.getsize(out_path) < os.path.getsize(font_path):
+                        subsets[font_path] = out_path
+                        log(logs, f"Subset font {os.path.basename(font_path)}: "
+                                  f"{os.path.getsize(font_path) // 1024} KB -> {os.path.getsize(out_path) // 1024} KB")
+                    else:
+                        os.remove(out_path)
+                except Exception as e:
+                    log(logs, f"Error subsetting font {os.path.basename(font_path)}: {e}")
+        return subsets[font_path]
+
+    def rewrite_font_src(match, base_dir):
+        ref = match.group(2).strip()
+        if not ref or ref.startswith(('/', 'data:')) or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', ref):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(base_dir, unquote(ref.split('#', 1)[0].split('?', 1)[0])))
+        rel_target = os.path.relpath(target, book_path).replace(os.sep, '/')
+        if rel_target in manifest:  # already a subset: re-subset from the original
+            target = os.path.normpath(os.path.join(book_path, *manifest[rel_target].split('/')))
+        if not target.lower().endswith(FONT_SOURCE_EXTS) or not os.path.isfile(target):
+            return match.group(0)
+        out_path = subset_for(target)
+        if not out_path:
+            return match.group(0)
+        manifest[os.path.relpath(out_path, book_path).replace(os.sep, '/')] = \
+            os.path.relpath(target, book_path).replace(os.sep, '/')
+        new_src = f'url("{os.path.relpath(out_path, base_dir).replace(os.sep, "/")}")'
+        if match.group(3):
+            new_src += f' format("{FONT_SUBSET_FLAVOR}")'
+        return new_src
+
+    changed_files = 0
+    for path in css_files + html_files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except Exception:
+            continue
+        if '@font-face' not in content.lower():
+            continue
+        base_dir = os.path.dirname(path)
+        new_content = FONT_FACE_RE.sub(
+            lambda face: FONT_SRC_RE.sub(lambda src: rewrite_font_src(src, base_dir), face.group(0)),
+            content,
+        )
+        if new_content != content:
+            with open(path, 'w', encoding='utf-8') as f:
                 f.write(new_content)
-            log(logs, f"Converted {changes} vertical styles in: {os.path.basename(filepath)}")
+            changed_files += 1
+
+    if manifest:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    fonts = sum(1 for v in subsets.values() if v)
+    if fonts:
+        log(logs, f"Subset {fonts} fonts, updated {changed_files} stylesheets.")
+    return fonts
+
+# --- Content-addressed blob store (optional cross-book dedup) ---
+
+# Large fonts/images (and CSS that only references such blobs) are stored
+# once under library/.blobs/<aa>/<sha256><ext> and hard-linked back into
+# the book, so book paths keep working. Chapter and CSS references are
+# rewritten to /blobs/<sha256><ext>, which is identical across books and
+# cacheable forever. Each book records its blobs in .blobs.json. Books on a
+# root on another filesystem can't be hard-linked: they keep their own
+# bytes and the store gets a copy, which pruning keeps while any such book
+# still lists it.
+BLOB_STORE_ENABLED = False
+BLOB_STORE_FOLDER = os.path.join(LIBRARY_FOLDER, '.blobs')
+BLOB_MANIFEST_FILE = '.blobs.json'
+BLOB_URL_PREFIX = '/blobs/'
+BLOB_MIN_BYTES = 4 * 1024
+BLOB_ASSET_EXTS = ('.ttf', '.otf', '.woff', '.woff2', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg')
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+BLOB_PRUNE_GRACE_SECONDS = 60 * 60  # unlinked blobs younger than this may belong to an import still in progress
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', re.IGNORECASE)
+
+def _blob_path(blob_name):
+    return os.path.join(BLOB_STORE_FOLDER, blob_name[:2], blob_name)
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(IMPORT_COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _copy_into_store(path, blob_path):
+    tmp_path = f"{blob_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, blob_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
+def _link_into_store(path, blob_name):
+    """
+    Makes path a hard link of the stored blob, storing it first if new. If
+    path is on another filesystem, the store gets a copy and path keeps its
+    own bytes. Returns False if the blob could not be stored.
+    """
+    blob_path = _blob_path(blob_name)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    try:
+        if not os.path.exists(blob_path):
+            try:
+                os.link(path, blob_path)
+            except FileExistsError:
+                pass
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                _copy_into_store(path, blob_path)
+        if not os.path.samefile(path, blob_path):
+            tmp_path = f"{path}.bloblink"
+            try:
+                os.link(blob_path, tmp_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                return True  # cross-device: the book keeps its own copy
+            os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Blob store link failed for {path}: {e}")
+        return False
+    return True
+
+def _store_blob(path):
+    if os.path.getsize(path) < BLOB_MIN_BYTES:
+        return None
+    blob_name = _hash_file(path) + os.path.splitext(path)[1].lower()
+    return blob_name if _link_into_store(path, blob_name) else None
+
+def _rewrite_ref(href, base_dir, blobs_by_path):
+    """Returns the blob URL for a relative reference to a stored blob, else None."""
+    raw = (href or '').strip()
+    if not raw or raw.startswith(('#', '/', 'data:')) or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', raw):
+        return None
+    path_part, sep, fragment = raw.partition('#')
+    target = os.path.normpath(os.path.join(base_dir, unquote(path_part.split('?', 1)[0])))
+    blob_name = blobs_by_path.get(target)
+    if not blob_name:
+        return None
+    return BLOB_URL_PREFIX + blob_name + (sep + fragment if sep else '')
+
+def _rewrite_css_blob_refs(css_path, blobs_by_path):
+    """Points url() references at blobs. Returns True if the CSS no longer has relative references."""
+    with open(css_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    base_dir = os.path.dirname(css_path)
+    unresolved = False
+
+    def replace(match):
+        nonlocal unresolved
+        url = _rewrite_ref(match.group(2), base_dir, blobs_by_path)
+        if url:
+            return f'url("{url}")'
+        ref = match.group(2).strip()
+        if ref and not ref.startswith(('#', '/', 'data:')) and not re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', ref):
+            unresolved = True
+        return match.group(0)
+
+    new_content = CSS_URL_RE.sub(replace, content)
+    if '@import' in new_content:
+        unresolved = True
+    if new_content != content:
+        with open(css_path, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+    return not unresolved
+
+def _rewrite_html_blob_refs(html_path, blobs_by_path):
+    with open(html_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    base_dir = os.path.dirname(html_path)
+    soup = BeautifulSoup(content, 'lxml')
+    modified = False
+
+    for tag, attrs in (('img', ('src',)), ('link', ('href',)), ('image', ('href', 'xlink:href'))):
+        for el in soup.find_all(tag):
+            for attr in attrs:
+                url = _rewrite_ref(el.get(attr), base_dir, blobs_by_path)
+                if url:
+                    el[attr] = url
+                    modified = True
+
+    for img in soup.find_all('img', srcset=True):
+        candidates = []
+        for candidate in img['srcset'].split(','):
+            parts = candidate.split()
+            if parts:
+                parts[0] = _rewrite_ref(parts[0], base_dir, blobs_by_path) or parts[0]
+            candidates.append(' '.join(parts))
+        srcset = ', '.join(candidates)
+        if srcset != img['srcset']:
+            img['srcset'] = srcset
+            modified = True
+
+    if modified:
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(str(soup))
+
+@traced('blob_dedup')
+def dedupe_book_assets(book_path, logs):
+    """
+    Moves a freshly imported book's large assets into the blob store and
+    rewrites references to them. No-op unless BLOB_STORE_ENABLED.
+    """
+    if not BLOB_STORE_ENABLED:
+        return 0
+
+    assets, css_files, html_files = [], [], []
+    for root, dirs, files in os.walk(book_path):
+        for file in files:
+            lower = file.lower()
+            full_path = os.path.join(root, file)
+            if lower.endswith(BLOB_ASSET_EXTS):
+                assets.append(full_path)
+            elif lower.endswith('.css'):
+                css_files.append(full_path)
+            elif lower.endswith(('.html', '.xhtml')):
+                html_files.append(full_path)
+
+    blobs_by_path = {}
+    for path in assets:
+        try:
+            blob_name = _store_blob(path)
+        except Exception as e:
+            log(logs, f"Error storing blob {os.path.basename(path)}: {e}")
+            blob_name = None
+        if blob_name:
+            blobs_by_path[os.path.normpath(path)] = blob_name
+
+    # CSS can only be shared once its own url()s are absolute blob URLs.
+    for path in css_files:
+        try:
+            if _rewrite_css_blob_refs(path, blobs_by_path):
+                blob_name = _store_blob(path)
+                if blob_name:
+                    blobs_by_path[os.path.normpath(path)] = blob_name
+        except Exception as e:
+            log(logs, f"Error processing CSS {os.path.basename(path)}: {e}")
+
+    if not blobs_by_path:
+        return 0
+
+    for path in html_files:
+        try:
+            _rewrite_html_blob_refs(path, blobs_by_path)
+        except Exception as e:
+            log(logs, f"Error processing HTML {os.path.basename(path)}: {e}")
+
+    manifest = {
+        os.path.relpath(path, book_path).replace(os.sep, '/'): blob_name
+        for path, blob_name in blobs_by_path.items()
+    }
+    with open(os.path.join(book_path, BLOB_MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    log(logs, f"Stored {len(manifest)} assets in the blob store.")
+    return len(manifest)
+
+def _read_blob_manifest(book_path):
+    try:
+        with open(os.path.join(book_path, BLOB_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except FileNotFoundError:
+        return {}
     except Exception as e:
-        log(logs, f"Error converting CSS {filepath}: {e}")
+        print(f"Error reading blob manifest in {book_path}: {e}")
+        return {}
+
+def relink_book_blobs(book_path):
+    """
+    Re-registers a restored book's blobs (its chapters already reference
+    /blobs/ URLs). Raises if one can't be stored, so the book is not
+    published with dangling blob URLs.
+    """
+    for relpath, blob_name in _read_blob_manifest(book_path).items():
+        path = os.path.join(book_path, *relpath.split('/'))
+        if BLOB_NAME_RE.match(blob_name) and os.path.isfile(path):
+            if not _link_into_store(path, blob_name):
+                raise OSError(f"Could not store blob {blob_name} for {relpath}")
+
+def _roots_off_store():
+    """Roots on another filesystem than the blob store, or None if one can't be checked (e.g. offline)."""
+    try:
+        store_dev = os.stat(BLOB_STORE_FOLDER).st_dev
+    except OSError:
+        return []
+    roots = []
+    for root in LIBRARY_ROOTS:
+        try:
+            if os.stat(root).st_dev != store_dev:
+                roots.append(root)
+        except OSError:
+            return None
+    return roots
+
+def _blobs_held_by(roots):
+    """Blob names listed by books (published or still staging) on the given roots."""
+    held = set()
+    for root in roots:
+        try:
+            entries = os.listdir(root)
+        except OSError:
+            continue
+        for entry in entries:
+            if is_book_dir_name(entry) or entry.startswith(STAGING_PREFIXES):
+                held.update(_read_blob_manifest(os.path.join(root, entry)).values())
+    return held
+
+def prune_blobs(blob_names):
+    """
+    Removes blobs no book uses any more: link count back to 1 and, if some
+    roots are on another filesystem, not listed by a book there (those keep
+    unlinked copies) and older than BLOB_PRUNE_GRACE_SECONDS.
+    """
+    removed = 0
+    foreign_roots = held = None
+    now = time.time()
+    for blob_name in blob_names:
+        if not BLOB_NAME_RE.match(blob_name):
+            continue
+        blob_path = _blob_path(blob_name)
+        try:
+            st = os.stat(blob_path)
+            if st.st_nlink > 1:
+                continue
+            if foreign_roots is None:
+                foreign_roots = _roots_off_store()
+                if foreign_roots is None:
+                    break  # a root is unreachable: its books may still use copies
+                held = _blobs_held_by(foreign_roots)
+            if foreign_roots and (blob_name in held or now - st.st_mtime < BLOB_PRUNE_GRACE_SECONDS):
+                continue
+            os.remove(blob_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error pruning blob {blob_name}: {e}")
+    return removed
+
+# --- Book metadata (container.xml -> OPF, single lxml pass) ---
+
+CONTAINER_NS = 'urn:oasis:names:tc:opendocument:xmlns:container'
+OPF_MEDIA_TYPE = 'application/oebps-package+xml'
+
+def _localname(tag):
+    if not isinstance(tag, str):
+        return None  # comments / processing instructions
+    return tag.rpartition('}')[2].rpartition(':')[2]
+
+OPF_TAGS = tuple(f'{{*}}{name}' for name in ('title', 'creator', 'subject', 'meta', 'item', 'metadata', 'manifest'))
+OPF_SPINE_TAGS = OPF_TAGS + ('{*}itemref', '{*}spine')
+
+def _xml_iterparse(path, events=('end',), tag=None):
+    return etree.iterparse(
+        path, events=events, tag=tag, recover=True, resolve_entities=False, no_network=True,
+    )
+
+@traced('opf_locate')
+def find_opf_path(book_dir):
+    """
+    Locates the package document via META-INF/container.xml (first OPF
+    rootfile), falling back to a recursive search for broken books.
+    """
+    container_path = os.path.join(book_dir, 'META-INF', 'container.xml')
+    if os.path.isfile(container_path):
+        try:
+            rootfiles = []
+            for _, el in _xml_iterparse(container_path):
+                if _localname(el.tag) == 'rootfile' and el.get('full-path'):
+                    rootfiles.append((el.get('full-path'), (el.get('media-type') or '').strip().lower()))
+            rootfiles.sort(key=lambda rf: rf[1] != OPF_MEDIA_TYPE)
+            book_root_real = os.path.realpath(book_dir)
+            for full_path, _ in rootfiles:
+                for candidate in (full_path, unquote(full_path)):
+                    opf_path = os.path.normpath(os.path.join(book_dir, candidate.strip().lstrip('/')))
+                    opf_real = os.path.realpath(opf_path)
+                    if opf_real.startswith(book_root_real + os.sep) and os.path.isfile(opf_path):
+                        return opf_path
+        except Exception as e:
+            print(f"container.xml error for {book_dir}: {e}")
+
+    opf_files = glob.glob(os.path.join(book_dir, '**', '*.opf'), recursive=True)
+    return opf_files[0] if opf_files else None
+
+@traced('opf_parse')
+def parse_opf(opf_path, include_spine=False):
+    """
+    Reads the fields we need from an OPF in one streaming pass. Elements are
+    matched by local name so missing/odd namespace prefixes still work.
+    Returns dict: {title, creator, subjects, cover_meta, items, spine}; title
+    and creator are None when absent, items are manifest <item> attribute
+    dicts, spine is the list of itemref idrefs (only with include_spine).
+    """
+    title = None
+    creator = None
+    subjects = []
+    cover_meta = None
+    items = []
+    seen_metadata = False
+    seen_manifest = False
+    in_manifest = False
+    spine = []
+    seen_spine = False
+
+    tags = OPF_SPINE_TAGS if include_spine else OPF_TAGS
+    for event, el in _xml_iterparse(opf_path, events=('start', 'end'), tag=tags):
+        name = _localname(el.tag)
+        if event == 'start':
+            if name == 'manifest' and not seen_manifest:
+                in_manifest = True
+            continue
+
+        if name == 'title' and title is None:
+            title = ''.join(el.itertext())
+        elif name == 'creator' and creator is None:
+            creator = ''.join(el.itertext())
+        elif name == 'subject':
+            text = ''.join(el.itertext()).strip()
+            if text:
+                subjects.append(text)
+        elif name == 'meta' and cover_meta is None and el.get('name') == 'cover':
+            cover_meta = el.get('content') or ''
+        elif name == 'item' and in_manifest:
+            items.append({
+                'id': el.get('id'),
+                'href': el.get('href'),
+                'media-type': el.get('media-type'),
+                'properties': el.get('properties'),
+            })
+            el.clear()
+        elif name == 'metadata':
+            seen_metadata = True
+        elif name == 'manifest' and in_manifest:
+            in_manifest = False
+            seen_manifest = True
+        elif name == 'itemref' and not seen_spine:
+            if el.get('idref'):
+                spine.append(el.get('idref'))
+        elif name == 'spine':
+            seen_spine = True
+
+        # Metadata precedes the manifest in practice; the guide is never
+        # needed, so stop as soon as everything asked for has been read.
+        if seen_metadata and seen_manifest and (seen_spine or not include_spine):
+            break
+
+    return {
+        'title': title,
+        'creator': creator,
+        'subjects': subjects,
+        'cover_meta': cover_meta,
+        'items': items if seen_manifest else None,
+        'spine': spine,
+    }
 
-def get_book_metadata(book_dir_name):
+def get_book_metadata(book_dir_name, book_path=None):
     """
     Attempts to extract metadata from .opf file.
     Returns dict: {title, author, cover_path}
     """
-    book_dir = os.path.join(LIBRARY_FOLDER, book_dir_name)
-    opf_files = glob.glob(os.path.join(book_dir, '**', '*.opf'), recursive=True)
-    if not opf_files:
+    book_dir = book_path or resolve_book_path(book_dir_name)
+    opf_path = find_opf_path(book_dir) if book_dir else None
+    if not opf_path:
         # print(f"No OPF found in {book_dir}")
         return None
     
-    opf_path = opf_files[0]
-    
     try:
         book_root_real = os.path.realpath(book_dir)
+        library_root = os.path.dirname(book_dir)
 
-        with open(opf_path, 'r', encoding='utf-8') as f:
-            # parsing as 'xml' might fail with some encodings or malformed headers
-            # 'html.parser' is more lenient
-            content = f.read()
-            soup = BeautifulSoup(content, 'xml')
-
-        # Try finding tags with or without namespace prefixes
-        title_tag = soup.find('title') or soup.find('dc:title')
-        title = title_tag.get_text() if title_tag else book_dir_name
+        opf = parse_opf(opf_path)
 
-        creator_tag = soup.find('creator') or soup.find('dc:creator')
-        author = creator_tag.get_text() if creator_tag else "Unknown"
+        title = opf['title'] if opf['title'] is not None else book_dir_name
+        author = opf['creator'] if opf['creator'] is not None else "Unknown"
 
         # Extract Subjects (Categories)
-        subjects = []
-        # Find all tags that might be subjects
-        for tag in soup.find_all(['subject', 'dc:subject']):
-            text = tag.get_text().strip()
-            if text:
-                subjects.append(text)
+        subjects = opf['subjects']
 
         # Cover finding: prioritize EPUB standards and handle common EPUB2 quirks.
         image_exts = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.avif')
@@ -338,32 +1633,48 @@ def get_book_metadata(book_dir_name):
             if not (full_real == book_root_real or full_real.startswith(book_root_real + os.sep)):
                 return None
             if os.path.isfile(full_path):
-                return os.path.relpath(full_path, LIBRARY_FOLDER)
+                return os.path.relpath(full_path, library_root)
             return None
 
         def extract_cover_from_xhtml(xhtml_full_path):
             xhtml_real = os.path.realpath(xhtml_full_path)
             if not (xhtml_real == book_root_real or xhtml_real.startswith(book_root_real + os.sep)):
                 return None
+            # Cover pages are XHTML; parse as XML (recovering from minor breakage)
+            # and fall back to the lenient HTML parser only if that finds nothing.
+            img = None
+            svg_image = None
             try:
-                with open(xhtml_full_path, 'r', encoding='utf-8', errors='ignore') as xf:
-                    xhtml = xf.read()
-            except Exception:
-                return None
-
-            try:
-                doc = BeautifulSoup(xhtml, 'html.parser')
+                parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+                root = etree.parse(xhtml_full_path, parser).getroot()
             except Exception:
-                return None
+                root = None
+
+            if root is not None:
+                for el in root.iter():
+                    name = _localname(el.tag)
+                    if name == 'img' and img is None:
+                        img = el
+                    elif name == 'image' and svg_image is None:
+                        svg_image = el
+                    if img is not None and svg_image is not None:
+                        break
+
+            if img is None and svg_image is None:
+                try:
+                    with open(xhtml_full_path, 'r', encoding='utf-8', errors='ignore') as xf:
+                        doc = BeautifulSoup(xf.read(), 'html.parser')
+                except Exception:
+                    return None
+                img = doc.find('img')
+                svg_image = doc.find('image')
 
             xhtml_dir = os.path.dirname(xhtml_full_path)
 
-            img = doc.find('img')
-            if img and img.get('src'):
+            if img is not None and img.get('src'):
                 return resolve_href_to_relpath(img.get('src'), xhtml_dir)
 
-            svg_image = doc.find('image')
-            if svg_image:
+            if svg_image is not None:
                 href = (
                     svg_image.get('href')
                     or svg_image.get('xlink:href')
@@ -374,57 +1685,59 @@ def get_book_metadata(book_dir_name):
 
             return None
 
-        cover_path = None
-        cover_item = None
-        manifest = soup.find('manifest')
-        opf_dir = os.path.dirname(opf_path)
+        with trace_span('cover_resolve'):
+            cover_path = None
+            cover_item = None
+            manifest = opf['items']
+            opf_dir = os.path.dirname(opf_path)
+
+            def find_item(predicate):
+                return next((item for item in manifest if predicate(item)), None)
 
-        if manifest:
-            # 1) EPUB 3: properties="cover-image"
-            cover_item = manifest.find('item', attrs={'properties': lambda x: x and 'cover-image' in x})
+            if manifest is not None:
+                # 1) EPUB 3: properties="cover-image"
+                cover_item = find_item(lambda i: 'cover-image' in (i['properties'] or ''))
 
-            # 2) EPUB 2: <meta name="cover" content="item-id" /> (sometimes incorrectly a path)
-            if not cover_item and not cover_path:
-                meta_cover = soup.find('meta', attrs={'name': 'cover'})
-                if meta_cover:
-                    cover_ref = (meta_cover.get('content') or '').strip()
+                # 2) EPUB 2: <meta name="cover" content="item-id" /> (sometimes incorrectly a path)
+                if not cover_item and not cover_path and opf['cover_meta'] is not None:
+                    cover_ref = opf['cover_meta'].strip()
                     if cover_ref:
-                        cover_item = manifest.find('item', id=cover_ref) or manifest.find('item', attrs={'href': cover_ref})
+                        cover_item = find_item(lambda i: i['id'] == cover_ref) or find_item(lambda i: i['href'] == cover_ref)
                         if not cover_item and looks_like_path(cover_ref):
                             cover_path = resolve_href_to_relpath(cover_ref, opf_dir)
 
-            # 3) Common conventions
-            if not cover_item:
-                cover_item = (
-                    manifest.find('item', id='cover-image')
-                    or manifest.find('item', id='cover')
-                )
-
-            # 4) If the selected item isn't an image, try extracting from its XHTML wrapper.
-            if not cover_path and cover_item:
-                href = cover_item.get('href') or ''
-                media_type = (cover_item.get('media-type') or '').strip().lower()
-                if href:
-                    rel_candidate = resolve_href_to_relpath(href, opf_dir)
-                    is_image = media_type.startswith('image/') or any(href.lower().endswith(ext) for ext in image_exts)
-                    if is_image:
-                        cover_path = rel_candidate
-                    else:
-                        full_xhtml_path = os.path.normpath(os.path.join(opf_dir, unquote(strip_fragment_and_query(href))))
-                        cover_path = extract_cover_from_xhtml(full_xhtml_path) or rel_candidate
-
-            # 5) Final fallback: first image item whose id/href suggests it's a cover.
-            if not cover_path:
-                for item in manifest.find_all('item'):
-                    href = (item.get('href') or '').strip()
-                    media_type = (item.get('media-type') or '').strip().lower()
-                    item_id = (item.get('id') or '').lower()
-                    if not href or not media_type.startswith('image/'):
-                        continue
-                    if 'cover' in item_id or 'cover' in href.lower():
-                        cover_path = resolve_href_to_relpath(href, opf_dir)
-                        if cover_path:
-                            break
+                # 3) Common conventions
+                if not cover_item:
+                    cover_item = (
+                        find_item(lambda i: i['id'] == 'cover-image')
+                        or find_item(lambda i: i['id'] == 'cover')
+                    )
+
+                # 4) If the selected item isn't an image, try extracting from its XHTML wrapper.
+                if not cover_path and cover_item:
+                    href = cover_item['href'] or ''
+                    media_type = (cover_item['media-type'] or '').strip().lower()
+                    if href:
+                        rel_candidate = resolve_href_to_relpath(href, opf_dir)
+                        is_image = media_type.startswith('image/') or any(href.lower().endswith(ext) for ext in image_exts)
+                        if is_image:
+                            cover_path = rel_candidate
+                        else:
+                            full_xhtml_path = os.path.normpath(os.path.join(opf_dir, unquote(strip_fragment_and_query(href))))
+                            cover_path = extract_cover_from_xhtml(full_xhtml_path) or rel_candidate
+
+                # 5) Final fallback: first image item whose id/href suggests it's a cover.
+                if not cover_path:
+                    for item in manifest:
+                        href = (item['href'] or '').strip()
+                        media_type = (item['media-type'] or '').strip().lower()
+                        item_id = (item['id'] or '').lower()
+                        if not href or not media_type.startswith('image/'):
+                            continue
+                        if 'cover' in item_id or 'cover' in href.lower():
+                            cover_path = resolve_href_to_relpath(href, opf_dir)
+                            if cover_path:
+                                break
 
         return {
             "title": title,
@@ -444,6 +1757,156 @@ def get_book_metadata(book_dir_name):
             "subjects": []
         }
 
+# --- Book position index (global progress / deep jumps without loading chapters) ---
+
+POSITION_INDEX_FILE = '.positions.json'
+POSITION_INDEX_VERSION = 1
+# Mirrors READING_BLOCK_SELECTOR in js/viewer.js; block N without an id gets
+# the auto anchor "__epub_auto_N" in the viewer.
+READING_BLOCK_TAGS = frozenset({'p', 'li', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'dt', 'dd'})
+POSITION_SKIP_TAGS = frozenset({'script', 'style', 'template', 'noscript'})
+# Reading-speed estimate for time-left: CJK characters vs. other non-space characters.
+CJK_CHARS_PER_MINUTE = 400
+LATIN_CHARS_PER_MINUTE = 1000
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]')
+
+def _chapter_positions(chapter_path):
+    """
+    Returns (chars, cjk_chars, offsets, ids) for one chapter: non-whitespace
+    character count of the body, and for every reading block (in document
+    order) the character offset where it starts. ids maps block index to an
+    explicit id attribute, if any.
+    """
+    with open(chapter_path, 'rb') as f:
+        root = etree.fromstring(f.read(), etree.HTMLParser(encoding='utf-8'))
+    body = root.find('body') if root is not None else None
+    if body is None:
+        return 0, 0, [], {}
+
+    chars = 0
+    cjk = 0
+    offsets = []
+    ids = {}
+
+    def add(text):
+        nonlocal chars, cjk
+        if text:
+            text = _WHITESPACE_RE.sub('', text)
+            chars += len(text)
+            cjk += len(_CJK_RE.findall(text))
+
+    stack = [(body, False)]
+    while stack:
+        el, done = stack.pop()
+        if done:
+            if el is not body:
+                add(el.tail)
+            continue
+        stack.append((el, True))
+        if not isinstance(el.tag, str):
+            continue  # comment / processing instruction: only its tail counts
+        tag = el.tag.lower()
+        if tag in POSITION_SKIP_TAGS:
+            continue
+        if tag in READING_BLOCK_TAGS:
+            if el.get('id'):
+                ids[str(len(offsets))] = el.get('id')
+            offsets.append(chars)
+        add(el.text)
+        stack.extend((child, False) for child in reversed(el))
+
+    return chars, cjk, offsets, ids
+
+def build_position_index(book_dir_name, book_path=None):
+    """
+    Computes the position index for a book from its OPF spine. Chapter hrefs
+    are library-relative, matching the spine paths the viewer uses. book_path
+    lets a book still in its staging dir be indexed under its final name.
+    """
+    book_dir = book_path or resolve_book_path(book_dir_name)
+    opf_path = find_opf_path(book_dir) if book_dir else None
+    if not opf_path:
+        return None
+
+    opf = parse_opf(opf_path, include_spine=True)
+    manifest = {item['id']: item['href'] for item in (opf['items'] or []) if item['id'] and item['href']}
+    opf_dir = posixpath.join(book_dir_name, os.path.dirname(os.path.relpath(opf_path, book_dir)).replace(os.sep, '/'))
+    book_prefix = book_dir_name + '/'
+    book_root_real = os.path.realpath(book_dir)
+
+    chapters = []
+    total = 0
+    total_cjk = 0
+    for idref in opf['spine']:
+        href = manifest.get(idref)
+        if not href:
+            continue
+        href = posixpath.normpath(posixpath.join(opf_dir, href.split('#', 1)[0]))
+        chapter_path = os.path.join(book_dir, unquote(href[len(book_prefix):])) if href.startswith(book_prefix) else None
+        chars, cjk, offsets, ids = 0, 0, [], {}
+        if (chapter_path and os.path.realpath(chapter_path).startswith(book_root_real + os.sep)
+                and os.path.isfile(chapter_path)):
+            try:
+                chars, cjk, offsets, ids = _chapter_positions(chapter_path)
+            except Exception as e:
+                print(f"Position index error for {chapter_path}: {e}")
+        chapter = {'href': href, 'start': total, 'chars': chars, 'blocks': len(offsets), 'offsets': offsets}
+        if ids:
+            chapter['ids'] = ids
+        chapters.append(chapter)
+        total += chars
+        total_cjk += cjk
+
+    minutes = total_cjk / CJK_CHARS_PER_MINUTE + (total - total_cjk) / LATIN_CHARS_PER_MINUTE
+    return {
+        'version': POSITION_INDEX_VERSION,
+        'totalChars': total,
+        'charsPerMinute': round(total / minutes) if minutes > 0 else LATIN_CHARS_PER_MINUTE,
+        'chapters': chapters,
+    }
+
+@traced('position_index')
+def save_position_index(book_dir_name, logs=None, book_path=None):
+    book_path = book_path or resolve_book_path(book_dir_name)
+    index = build_position_index(book_dir_name, book_path) if book_path else None
+    if index is None:
+        return None
+    index_path = os.path.join(book_path, POSITION_INDEX_FILE)
+    tmp_path = f"{index_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        # Rebuilt in the background too, so never expose a half-written file.
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, index_path)
+        if logs is not None:
+            log(logs, f"Indexed {len(index['chapters'])} chapters ({index['totalChars']} characters).")
+    except Exception as e:
+        print(f"Error saving position index for {book_dir_name}: {e}")
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+    return index
+
+def load_position_index(book_dir_name):
+    """Returns the stored index, (re)building it for books imported before it existed."""
+    book_path = resolve_book_path(book_dir_name)
+    if book_path is None:
+        return None
+    try:
+        with open(os.path.join(book_path, POSITION_INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == POSITION_INDEX_VERSION:
+            return index
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error loading position index for {book_dir_name}: {e}")
+    return save_position_index(book_dir_name)
+
+@traced('json_load')
 def load_user_metadata():
     if not os.path.exists(USER_METADATA_FILE):
         return {}
@@ -454,22 +1917,518 @@ def load_user_metadata():
         print(f"Error loading user metadata: {e}")
         return {}
 
-def save_user_metadata(data):
-    try:
-        with open(USER_METADATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving user metadata: {e}")
+_USER_METADATA_SAVE_LOCK = threading.Lock()
+
+@traced('json_save')
+def save_user_metadata(data, changed_books=None):
+    """
+    Writes user metadata atomically. changed_books lists the books whose
+    entries this write changed; the annotation feed index is then patched
+    for just those books instead of being rebuilt from the file.
+    """
+    # Write to a temp file and rename so readers (and backups) never see a truncated file.
+    tmp_path = f"{USER_METADATA_FILE}.{uuid.uuid4().hex[:8]}.tmp"
+    with _USER_METADATA_SAVE_LOCK:
+        key_before = _user_metadata_key()
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, USER_METADATA_FILE)
+        except Exception as e:
+            print(f"Error saving user metadata: {e}")
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+            return
+        if changed_books is not None:
+            # Still under the save lock, so patches apply in write order.
+            patch_annotation_index(data, changed_books, key_before, _user_metadata_key())
 
 def is_valid_book_dir(book_dir):
-    if not book_dir:
-        return False
-    if ".." in book_dir or book_dir.startswith('/') or book_dir.startswith('\\'):
-        return False
-    full_path = os.path.join(LIBRARY_FOLDER, book_dir)
-    if not os.path.isdir(full_path) or book_dir in IGNORE_DIRS:
+    return resolve_book_path(book_dir) is not None
+
+# --- Library backup / restore (streamed tar, no temporary files) ---
+
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_METADATA_NAME = 'user_metadata.json'
+BACKUP_LIBRARY_PREFIX = 'library/'
+BACKUP_MAX_METADATA_BYTES = 64 * 1024 * 1024
+BACKUP_RESTORE_WORKERS = 4
+_TAR_BLOCK = tarfile.BLOCKSIZE
+
+def _tar_header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+def _tar_padding(size):
+    remainder = size % _TAR_BLOCK
+    return b'\0' * (_TAR_BLOCK - remainder) if remainder else b''
+
+def iter_library_archive(book_dirs):
+    """
+    Yields a tar archive of the given books plus a snapshot of their user
+    metadata, chunk by chunk. Memory use is constant: headers are generated
+    per file and file bodies are read in BACKUP_CHUNK_SIZE pieces.
+    """
+    user_meta = load_user_metadata()
+    snapshot = {book: user_meta[book] for book in book_dirs if book in user_meta}
+    data = json.dumps(snapshot, ensure_ascii=False, indent=2).encode('utf-8')
+    yield _tar_header(BACKUP_METADATA_NAME, len(data), time.time()) + data + _tar_padding(len(data))
+
+    for book_dir in book_dirs:
+        book_path = resolve_book_path(book_dir)
+        if book_path is None:
+            continue  # deleted (or its root went away) while exporting
+        library_root = os.path.dirname(book_path)
+        for root, dirs, files in os.walk(book_path):
+            dirs.sort()
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                try:
+                    st = os.lstat(full_path)
+                    if not stat.S_ISREG(st.st_mode):
+                        continue
+                    f = open(full_path, 'rb')
+                except OSError:
+                    continue  # removed while exporting
+
+                arcname = BACKUP_LIBRARY_PREFIX + os.path.relpath(full_path, library_root).replace(os.sep, '/')
+                with f:
+                    yield _tar_header(arcname, st.st_size, st.st_mtime)
+                    remaining = st.st_size
+                    while remaining > 0:
+                        chunk = f.read(min(BACKUP_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            # File shrank underneath us; keep the archive well-formed.
+                            chunk = b'\0' * min(BACKUP_CHUNK_SIZE, remaining)
+                        remaining -= len(chunk)
+                        yield chunk
+                yield _tar_padding(st.st_size)
+
+    yield b'\0' * (_TAR_BLOCK * 2)
+
+_RESTORE_METADATA_LOCK = threading.Lock()  # restore workers merge user metadata one at a time
+
+def _finalize_restored_book(staging_path, book_dir, meta_entry=None):
+    try:
+        relink_book_blobs(staging_path)
+        if not os.path.exists(os.path.join(staging_path, POSITION_INDEX_FILE)):
+            save_position_index(book_dir, book_path=staging_path)
+        publish_book(staging_path, book_dir)
+    except Exception:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+
+    # Merge the book's snapshot entry as soon as it is visible, so a stream
+    # that fails later does not leave published books without their metadata.
+    if isinstance(meta_entry, dict):
+        with _RESTORE_METADATA_LOCK:
+            user_meta = load_user_metadata()
+            if book_dir not in user_meta:
+                user_meta[book_dir] = meta_entry
+                save_user_metadata(user_meta, changed_books=[book_dir])
+    return book_dir
+
+def restore_library_archive(fileobj, logs, workers=BACKUP_RESTORE_WORKERS):
+    """
+    Restores an archive produced by iter_library_archive from a readable,
+    non-seekable stream. Each book is written to a hidden staging directory,
+    post-processed (position index) in a thread pool while the stream keeps
+    being read, and then published with an atomic rename together with its
+    entry from the metadata snapshot (which leads the archive). Books that
+    already exist are skipped. Returns {'restored': [...], 'skipped': [...]}
+    where restored only lists books that were actually published.
+    """
+    restored = []
+    skipped = []
+    snapshot = {}
+    current = None  # (book_dir, staging_path) or (book_dir, None) when skipping
+    futures = []  # (book_dir, future)
+    reserved = []
+
+    def finish_current():
+        if current and current[1]:
+            meta_entry = snapshot.get(current[0]) if isinstance(snapshot, dict) else None
+            futures.append((current[0], pool.submit(_finalize_restored_book, current[1], current[0], meta_entry)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        try:
+            with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+                for member in tar:
+                    if member.name == BACKUP_METADATA_NAME and member.isfile():
+                        if member.size > BACKUP_MAX_METADATA_BYTES:
+                            raise ArchiveImportError("Metadata snapshot is too large.")
+                        snapshot = json.loads(tar.extractfile(member).read().decode('utf-8'))
+                        continue
+
+                    if not member.name.startswith(BACKUP_LIBRARY_PREFIX):
+                        log(logs, f"Ignoring unexpected entry: {member.name}")
+                        continue
+                    relpath = _safe_entry_relpath(member.name[len(BACKUP_LIBRARY_PREFIX):])
+                    if relpath is None:
+                        raise ArchiveImportError(f"Unsafe path in archive: {member.name}")
+                    if not (member.isfile() or member.isdir()):
+                        log(logs, f"Ignoring non-regular entry: {member.name}")
+                        continue
+
+                    book_dir, _, inner = relpath.partition(os.sep)
+                    if current is None or current[0] != book_dir:
+                        finish_current()
+                        if not is_book_dir_name(book_dir) or reserve_book_dir(book_dir, allow_rename=False) is None:
+                            log(logs, f"Skipping existing or invalid book: {book_dir}")
+                            skipped.append(book_dir)
+                            current = (book_dir, None)
+                        else:
+                            reserved.append(book_dir)
+                            staging_path = staging_path_for(choose_library_root(), book_dir, kind='restore')
+                            os.makedirs(staging_path)
+                            current = (book_dir, staging_path)
+                            log(logs, f"Restoring: {book_dir}")
+
+                    if current[1] is None or not inner:
+                        continue
+                    dest_path = os.path.join(current[1], inner)
+                    if member.isdir():
+                        os.makedirs(dest_path, exist_ok=True)
+                        continue
+                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                    with tar.extractfile(member) as src, open(dest_path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, BACKUP_CHUNK_SIZE)
+                finish_current()
+                current = None
+        except Exception:
+            if current and current[1]:
+                shutil.rmtree(current[1], ignore_errors=True)
+            raise
+        finally:
+            for book_dir, future in futures:
+                try:
+                    future.result()
+                    restored.append(book_dir)
+                except Exception as e:
+                    log(logs, f"Error finalizing restored book {book_dir}: {e}")
+            for book_dir in reserved:
+                release_book_dir(book_dir)
+
+    log(logs, f"Restored {len(restored)} books, skipped {len(skipped)}.")
+    return {'restored': restored, 'skipped': skipped}
+
+# --- Background maintenance (trash reclaim, orphan sweep, store compaction) ---
+
+# Deleted books are renamed into their root's TRASH_DIR_NAME (same
+# filesystem, so the rename is instant) and removed here, off the request
+# thread. The same pass sweeps staging dirs of crashed imports/restores and,
+# at most once per MAINTENANCE_COMPACT_INTERVAL_SECONDS, compacts the
+# metadata/index stores a few books at a time with short pauses so readers
+# keep the disk.
+TRASH_DIR_NAME = '.trash'
+STAGING_PREFIXES = ('.import-', '.restore-')
+MAINTENANCE_INTERVAL_SECONDS = 60
+MAINTENANCE_STALE_SECONDS = 6 * 60 * 60  # uploads/staging dirs older than this are orphans
+MAINTENANCE_COMPACT_INTERVAL_SECONDS = 60 * 60
+MAINTENANCE_COMPACT_BATCH = 20  # books whose position index is checked per compaction pass
+MAINTENANCE_IO_PAUSE_SECONDS = 0.05
+
+_MAINTENANCE_WAKE = threading.Event()
+_MAINTENANCE_LOCK = threading.Lock()  # one pass at a time
+_MAINTENANCE_STATE = {'thread': None, 'last_compact': 0.0, 'compact_cursor': 0}
+
+def move_to_trash(path):
+    """Renames path into the trash of its library root and wakes the scheduler to reclaim it."""
+    trash_folder = os.path.join(os.path.dirname(path), TRASH_DIR_NAME)
+    os.makedirs(trash_folder, exist_ok=True)
+    trash_path = os.path.join(trash_folder, f"{int(time.time())}-{uuid.uuid4().hex[:8]}-{os.path.basename(path)}")
+    os.rename(path, trash_path)
+    _MAINTENANCE_WAKE.set()
+    return trash_path
+
+def _is_stale(path, now):
+    try:
+        return now - os.path.getmtime(path) > MAINTENANCE_STALE_SECONDS
+    except OSError:
         return False
-    return True
+
+def reclaim_trash():
+    """Removes trashed books, then any blobs only they were using. Returns the number reclaimed."""
+    reclaimed = 0
+    for root in LIBRARY_ROOTS:
+        trash_folder = os.path.join(root, TRASH_DIR_NAME)
+        if not os.path.isdir(trash_folder):
+            continue
+        for entry in sorted(os.listdir(trash_folder)):
+            path = os.path.join(trash_folder, entry)
+            if os.path.isdir(path):
+                blob_names = list(_read_blob_manifest(path).values())
+                shutil.rmtree(path, ignore_errors=True)
+                prune_blobs(blob_names)
+            else:
+                os.remove(path)
+            reclaimed += 1
+            time.sleep(MAINTENANCE_IO_PAUSE_SECONDS)
+    return reclaimed
+
+def sweep_orphans(now=None):
+    """
+    Trashes leftovers nobody will finish: uploads in UPLOAD_FOLDER, import and
+    restore staging dirs and metadata temp files, once they are older than
+    MAINTENANCE_STALE_SECONDS. Returns the count.
+    """
+    now = now or time.time()
+    swept = 0
+    if os.path.isdir(UPLOAD_FOLDER):
+        for entry in os.listdir(UPLOAD_FOLDER):
+            path = os.path.join(UPLOAD_FOLDER, entry)
+            if os.path.isfile(path) and _is_stale(path, now):
+                os.remove(path)
+                swept += 1
+
+    for root in LIBRARY_ROOTS:
+        try:
+            entries = os.listdir(root)
+        except OSError:
+            continue  # unavailable root
+        for entry in entries:
+            path = os.path.join(root, entry)
+            if not (entry.startswith(STAGING_PREFIXES) and os.path.isdir(path) and _is_stale(path, now)):
+                continue
+            # The dir's own mtime stops changing once its subdirs exist, so a
+            # long import/restore can look stale; its book id stays reserved
+            # until it is published or cleaned up.
+            with _LIBRARY_WRITE_LOCK:
+                if staging_book_dir(entry) in _RESERVED_BOOK_DIRS:
+                    continue
+                print(f"Sweeping abandoned import: {path}")
+                move_to_trash(path)
+            swept += 1
+
+    for path in glob.glob(f"{glob.escape(USER_METADATA_FILE)}.*.tmp"):
+        if _is_stale(path, now):
+            os.remove(path)
+            swept += 1
+    return swept
+
+def compact_stores():
+    """
+    Compacts the metadata and index stores: drops empty user-metadata entries
+    for books that are gone, builds missing or outdated position indexes for
+    a batch of books, and prunes unreferenced blobs. Returns a summary dict.
+    """
+    summary = {'metadata_dropped': 0, 'indexes_built': 0, 'blobs_pruned': 0}
+    snapshot = scan_library()
+    # Books on an unavailable root count as present; only their index check is skipped.
+    book_dir_set = set(snapshot.books)
+    book_dirs = sorted(book_dir for book_dir, entry in snapshot.books.items() if entry.available)
+
+    # Only entries with nothing worth keeping are dropped; annotations and
+    # categories of a book that was moved away by hand are left alone. Skip
+    # the save if a request rewrote the file meanwhile.
+    try:
+        mtime_ns = os.stat(USER_METADATA_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = None
+    if mtime_ns is not None:
+        user_meta = load_user_metadata()
+        empty = [
+            book_dir for book_dir, entry in user_meta.items()
+            if book_dir not in book_dir_set and (not isinstance(entry, dict) or not any(entry.values()))
+        ]
+        if empty and os.stat(USER_METADATA_FILE).st_mtime_ns == mtime_ns:
+            for book_dir in empty:
+                user_meta.pop(book_dir, None)
+            save_user_metadata(user_meta, changed_books=empty)
+            summary['metadata_dropped'] = len(empty)
+
+    if book_dirs:
+        start = _MAINTENANCE_STATE['compact_cursor'] % len(book_dirs)
+        batch = (book_dirs[start:] + book_dirs[:start])[:MAINTENANCE_COMPACT_BATCH]
+        _MAINTENANCE_STATE['compact_cursor'] = start + len(batch)
+        for book_dir in batch:
+            book_path = resolve_book_path(book_dir)
+            if book_path is None:
+                continue
+            index_path = os.path.join(book_path, POSITION_INDEX_FILE)
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    current = json.load(f).get('version') == POSITION_INDEX_VERSION
+            except Exception:
+                current = False
+            if not current and save_position_index(book_dir) is not None:
+                summary['indexes_built'] += 1
+            time.sleep(MAINTENANCE_IO_PAUSE_SECONDS)
+
+    if os.path.isdir(BLOB_STORE_FOLDER):
+        blob_names = [
+            name for _, _, files in os.walk(BLOB_STORE_FOLDER) for name in files if BLOB_NAME_RE.match(name)
+        ]
+        summary['blobs_pruned'] = prune_blobs(blob_names)
+    return summary
+
+def run_maintenance(force_compact=False):
+    """Runs one maintenance pass; each step is isolated so one failure doesn't stop the rest."""
+    with _MAINTENANCE_LOCK:
+        steps = [
+            ('tasks', _prune_upload_tasks),
+            ('trash', reclaim_trash),
+            ('orphans', sweep_orphans),
+            ('library', lambda: len(scan_library().books)),  # pick up books copied in by hand
+            ('annotations', lambda: len(get_annotation_index().records)),  # keep the feed index warm
+        ]
+        now = time.time()
+        if force_compact or now - _MAINTENANCE_STATE['last_compact'] >= MAINTENANCE_COMPACT_INTERVAL_SECONDS:
+            _MAINTENANCE_STATE['last_compact'] = now
+            steps.append(('compact', compact_stores))
+
+        results = {}
+        for name, step in steps:
+            try:
+                results[name] = step()
+            except Exception as e:
+                print(f"Maintenance step '{name}' failed: {e}")
+                results[name] = None
+        return results
+
+def _maintenance_loop():
+    while True:
+        run_maintenance()
+        _MAINTENANCE_WAKE.wait(MAINTENANCE_INTERVAL_SECONDS)
+        _MAINTENANCE_WAKE.clear()
+
+def start_maintenance_scheduler():
+    """Starts the background maintenance thread once per process."""
+    thread = _MAINTENANCE_STATE['thread']
+    if thread is not None and thread.is_alive():
+        return thread
+    thread = threading.Thread(target=_maintenance_loop, name='library-maintenance', daemon=True)
+    _MAINTENANCE_STATE['thread'] = thread
+    thread.start()
+    return thread
+
+# --- Static file cache (small library files, kept in memory) ---
+
+# A chapter turn re-reads the same XHTML/CSS for every reader of a book, and
+# on a network-mounted library each read is expensive. Files up to
+# STATIC_CACHE_MAX_FILE_BYTES are kept in an LRU bounded by
+# STATIC_CACHE_MAX_BYTES (body plus compressed variants), keyed by path and
+# revalidated against mtime/size on every request, so edits show up at once.
+STATIC_CACHE_ENABLED = True
+STATIC_CACHE_MAX_BYTES = 64 * 1024 * 1024
+STATIC_CACHE_MAX_FILE_BYTES = 512 * 1024
+STATIC_CACHE_COMPRESS_MIN_BYTES = 1024
+STATIC_CACHE_COMPRESSIBLE_TYPES = {
+    'application/xhtml+xml', 'application/javascript', 'application/json', 'application/xml',
+    'application/x-dtbncx+xml', 'application/oebps-package+xml', 'image/svg+xml',
+}
+
+class StaticFileCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # full_path -> entry, least recently used first
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0  # too large to cache
+
+    def lookup(self, full_path, st):
+        """Returns the cached entry for full_path, loading it on a miss; None if the file is too large."""
+        with self._lock:
+            entry = self._entries.get(full_path)
+            if entry is not None and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                self._entries.move_to_end(full_path)
+                self.hits += 1
+                return entry
+            if st.st_size > STATIC_CACHE_MAX_FILE_BYTES:
+                self.skipped += 1
+                return None
+            self.misses += 1
+
+        entry = _load_static_entry(full_path)
+        if entry is None or entry['cost'] > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.pop(full_path, None)
+            if old is not None:
+                self._bytes -= old['cost']
+            self._entries[full_path] = entry
+            self._bytes += entry['cost']
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['cost']
+                self.evictions += 1
+        return entry
+
+    def discard_prefix(self, prefix):
+        with self._lock:
+            for full_path in [p for p in self._entries if p.startswith(prefix)]:
+                self._bytes -= self._entries.pop(full_path)['cost']
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'skipped': self.skipped,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+STATIC_CACHE = StaticFileCache(STATIC_CACHE_MAX_BYTES)
+
+def _load_static_entry(full_path):
+    try:
+        with open(full_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size > STATIC_CACHE_MAX_FILE_BYTES:
+                return None
+            body = f.read()
+    except OSError:
+        return None
+
+    mimetype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    variants = {}
+    compressible = mimetype.startswith('text/') or mimetype in STATIC_CACHE_COMPRESSIBLE_TYPES
+    if compressible and len(body) >= STATIC_CACHE_COMPRESS_MIN_BYTES:
+        candidates = {'gzip': gzip.compress(body, compresslevel=6, mtime=0)}
+        if brotli is not None:
+            candidates['br'] = brotli.compress(body, quality=6)
+        variants = {name: data for name, data in candidates.items() if len(data) < len(body) * 0.9}
+
+    return {
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'mimetype': mimetype,
+        'etag': hashlib.sha256(body).hexdigest()[:32],
+        'body': body,
+        'variants': variants,
+        'cost': len(body) + sum(len(data) for data in variants.values()),
+    }
+
+def cached_file_response(entry):
+    encoding = next(
+        (name for name in ('br', 'gzip') if name in entry['variants'] and request.accept_encodings[name]),
+        None,
+    )
+    body = entry['variants'][encoding] if encoding else entry['body']
+    response = Response(body, mimetype=entry['mimetype'])
+    if entry['variants']:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # Same caching policy as send_from_directory: revalidate with ETag/Last-Modified.
+    response.set_etag(f"{entry['etag']}-{encoding}" if encoding else entry['etag'])
+    response.last_modified = entry['mtime']
+    response.cache_control.no_cache = True
+    return response.make_conditional(request, accept_ranges=encoding is None, complete_length=len(body))
 
 def normalize_annotation_style(style):
     return 'ul' if str(style).strip().lower() in {'ul', 'underline'} else 'bg'
@@ -486,53 +2445,342 @@ def sanitize_text_field(value, max_len):
         text = text[:max_len]
     return text
 
+# --- Library-wide annotation feed (NDJSON, cursor pagination) ---
+
+ANNOTATION_FEED_DEFAULT_LIMIT = 100
+ANNOTATION_FEED_MAX_LIMIT = 1000
+
+def _search_grams(text):
+    # Character bigrams: substring search for CJK and Latin text without a tokenizer.
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def _annotation_records(book_dir, entry):
+    """Returns (categories, [(sort key, feed item, search text)]) for one user-metadata entry."""
+    categories = entry.get('categories')
+    categories = set(categories) if isinstance(categories, list) else set()
+    records = []
+    annotations = entry.get('annotations')
+    if isinstance(annotations, list):
+        for annotation in annotations:
+            if not isinstance(annotation, dict) or not annotation.get('id'):
+                continue
+            try:
+                updated_at = int(annotation.get('updatedAt') or 0)
+            except (TypeError, ValueError):
+                updated_at = 0
+            text = f"{annotation.get('text') or ''}\n{annotation.get('note') or ''}".lower()
+            records.append(((updated_at, book_dir, str(annotation['id'])), dict(annotation, book=book_dir), text))
+    return categories, records
+
+class AnnotationIndex:
+    """
+    Immutable snapshot of every annotation in user_metadata.json, sorted by
+    (updatedAt, book, id). Keeps each book's keys and categories and a
+    bigram index over the lowercased text + note for search. Postings hold
+    sort keys grouped by book, so with_books() can derive an index with a
+    few books replaced, copying only their share and reusing the rest.
+    """
+    def __init__(self, user_meta=None):
+        self.records = {}  # sort key -> (feed item, search text)
+        self.by_book = {}  # book_dir -> frozenset of sort keys
+        self.categories = {}  # book_dir -> set of categories
+        self.grams = {}  # bigram -> {book_dir: frozenset of sort keys}
+        for book_dir, entry in (user_meta or {}).items():
+            if not isinstance(entry, dict):
+                continue
+            self.categories[book_dir], records = _annotation_records(book_dir, entry)
+            for gram, keys in self._add_records(book_dir, records).items():
+                self.grams.setdefault(gram, {})[book_dir] = keys
+        self.keys = sorted(self.records)
+
+    def _add_records(self, book_dir, records):
+        """Adds one book's records; returns its postings as {bigram: frozenset of sort keys}."""
+        grams = {}
+        for key, item, text in records:
+            self.records[key] = (item, text)
+            for gram in _search_grams(text):
+                grams.setdefault(gram, []).append(key)
+        if records:
+            self.by_book[book_dir] = frozenset(key for key, _, _ in records)
+        return {gram: frozenset(keys) for gram, keys in grams.items()}
+
+    def with_books(self, user_meta, book_dirs):
+        """Returns a new index with book_dirs re-read from user_meta (absent entries are dropped)."""
+        book_dirs = set(book_dirs)
+        index = AnnotationIndex()
+        index.records = dict(self.records)
+        index.by_book = dict(self.by_book)
+        index.categories = dict(self.categories)
+        touched = set()  # bigrams whose postings mention a changed book
+        added = {}  # book_dir -> {bigram: frozenset of sort keys}
+        new_keys = []
+        for book_dir in book_dirs:
+            for key in index.by_book.pop(book_dir, ()):
+                _, text = index.records.pop(key)
+                touched.update(_search_grams(text))
+            index.categories.pop(book_dir, None)
+            entry = user_meta.get(book_dir)
+            if not isinstance(entry, dict):
+                continue
+            index.categories[book_dir], records = _annotation_records(book_dir, entry)
+            added[book_dir] = index._add_records(book_dir, records)
+            touched.update(added[book_dir])
+            new_keys.extend(key for key, _, _ in records)
+
+        index.grams = dict(self.grams)
+        for gram in touched:
+            postings = {
+                book_dir: keys for book_dir, keys in index.grams.get(gram, {}).items() if book_dir not in book_dirs
+            }
+            for book_dir, book_grams in added.items():
+                if gram in book_grams:
+                    postings[book_dir] = book_grams[gram]
+            if postings:
+                index.grams[gram] = postings
+            else:
+                index.grams.pop(gram, None)
+        index.keys = [key for key in self.keys if key[1] not in book_dirs] + new_keys
+        index.keys.sort()  # two sorted runs: linear for timsort
+        return index
+
+    def query(self, books=None, categories=None, style=None, since=None, until=None, q=None,
+              cursor=None, descending=True, limit=ANNOTATION_FEED_DEFAULT_LIMIT):
+        """Returns (annotations, next_cursor); cursor is the sort key of the last item already seen."""
+        lo, hi = 0, len(self.keys)
+        if since is not None:
+            lo = bisect.bisect_left(self.keys, (since,))
+        if until is not None:
+            hi = bisect.bisect_left(self.keys, (until + 1,))
+        if cursor is not None:
+            if descending:
+                hi = min(hi, bisect.bisect_left(self.keys, cursor))
+            else:
+                lo = max(lo, bisect.bisect_right(self.keys, cursor))
+
+        candidates = None
+        if books is not None:
+            candidates = {key for book_dir in books for key in self.by_book.get(book_dir, ())}
+        if categories:
+            in_category = {
+                key for book_dir, book_categories in self.categories.items() if book_categories & categories
+                for key in self.by_book.get(book_dir, ())
+            }
+            candidates = in_category if candidates is None else candidates & in_category
+        if q:
+            postings = sorted((self.grams.get(gram, {}) for gram in _search_grams(q)), key=len)
+            if postings:
+                matches = set()
+                for book_dir, keys in postings[0].items():
+                    for posting in postings[1:]:
+                        keys = keys & posting.get(book_dir, frozenset())
+                        if not keys:
+                            break
+                    matches.update(keys)
+                candidates = matches if candidates is None else candidates & matches
+
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        if candidates is None:
+            ordered = (self.keys[pos] for pos in positions)
+        elif lo >= hi:
+            ordered = ()
+        elif len(candidates) * 4 >= hi - lo:
+            # Dense: walking the window in order stops after one page, no sort needed.
+            ordered = (self.keys[pos] for pos in positions if self.keys[pos] in candidates)
+        else:
+            # Keys are unique, so the position window maps onto a key window.
+            lo_key = self.keys[lo]
+            hi_key = self.keys[hi] if hi < len(self.keys) else None
+            ordered = sorted(
+                (key for key in candidates if key >= lo_key and (hi_key is None or key < hi_key)),
+                reverse=descending,
+            )
+
+        page = []
+        for key in ordered:
+            item, text = self.records[key]
+            if style and item.get('style') != style:
+                continue
+            if q and q not in text:
+                continue
+            page.append(key)
+            if len(page) > limit:
+                break
+        next_cursor = page[limit - 1] if len(page) > limit else None
+        return [self.records[key][0] for key in page[:limit]], next_cursor
+
+# 'key' is the user_metadata.json (inode, mtime, size) the index reflects.
+# In-band writes (save_user_metadata(..., changed_books=...)) patch just the
+# changed books and move the key along; anything else, e.g. an edit by
+# hand, gets a full rebuild in the background. 'pending' collects the
+# books patched while such a rebuild runs so they can be replayed on it.
+_ANNOTATION_INDEX = {'key': None, 'index': None, 'building': False, 'pending': None}
+_ANNOTATION_INDEX_LOCK = threading.Lock()  # guards _ANNOTATION_INDEX only; rebuilds run outside it
+_ANNOTATION_FIRST_BUILD_LOCK = threading.Lock()
+
+def _user_metadata_key():
+    try:
+        st = os.stat(USER_METADATA_FILE)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+def patch_annotation_index(user_meta, book_dirs, key_before, key_after):
+    """Applies an in-band write of book_dirs (file key key_before -> key_after) to the live index."""
+    with _ANNOTATION_INDEX_LOCK:
+        index = _ANNOTATION_INDEX['index']
+        if index is None:
+            return  # not built yet; the first build reads the file
+        _ANNOTATION_INDEX['index'] = index.with_books(user_meta, book_dirs)
+        if _ANNOTATION_INDEX['key'] == key_before:
+            _ANNOTATION_INDEX['key'] = key_after
+        pending = _ANNOTATION_INDEX['pending']
+        if pending is not None:
+            pending['books'].update((book_dir, user_meta.get(book_dir)) for book_dir in book_dirs)
+            if pending['key'] == key_before:
+                pending['key'] = key_after
+            else:
+                pending['in_sync'] = False
+
+def _rebuild_annotation_index():
+    # Background thread: full rebuild after an out-of-band change. Books
+    # patched meanwhile are replayed on the new index; if the file changed
+    # out of band again, it goes round once more.
+    try:
+        while True:
+            with _ANNOTATION_INDEX_LOCK:
+                pending = {'key': _user_metadata_key(), 'books': {}, 'in_sync': True}
+                _ANNOTATION_INDEX['pending'] = pending
+            index = AnnotationIndex(load_user_metadata())
+            with _ANNOTATION_INDEX_LOCK:
+                if pending['books']:
+                    index = index.with_books(pending['books'], pending['books'].keys())
+                _ANNOTATION_INDEX['index'] = index
+                if pending['in_sync'] and pending['key'] == _user_metadata_key():
+                    _ANNOTATION_INDEX['key'] = pending['key']
+                    _ANNOTATION_INDEX['building'] = False
+                    _ANNOTATION_INDEX['pending'] = None
+                    return
+    except Exception as e:
+        print(f"Error rebuilding annotation index: {e}")
+        with _ANNOTATION_INDEX_LOCK:
+            _ANNOTATION_INDEX['building'] = False
+            _ANNOTATION_INDEX['pending'] = None
+
+@traced('annotation_index')
+def get_annotation_index():
+    """
+    Returns the annotation index. Annotation and category writes patch it
+    in place (see patch_annotation_index). After any other change to
+    user_metadata.json, the previous index keeps being served while a
+    background thread rebuilds it; only the very first build is inline.
+    """
+    key = _user_metadata_key()
+    with _ANNOTATION_INDEX_LOCK:
+        index = _ANNOTATION_INDEX['index']
+        if index is not None:
+            if _ANNOTATION_INDEX['key'] != key and not _ANNOTATION_INDEX['building']:
+                _ANNOTATION_INDEX['building'] = True
+                threading.Thread(target=_rebuild_annotation_index, daemon=True).start()
+            return index
+
+    with _ANNOTATION_FIRST_BUILD_LOCK:
+        if _ANNOTATION_INDEX['index'] is None:
+            index = AnnotationIndex(load_user_metadata())
+            with _ANNOTATION_INDEX_LOCK:
+                if _ANNOTATION_INDEX['index'] is None:
+                    _ANNOTATION_INDEX['index'] = index
+                    _ANNOTATION_INDEX['key'] = key
+        return _ANNOTATION_INDEX['index']
+
+def encode_annotation_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key), ensure_ascii=False).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_annotation_cursor(token):
+    """Returns the sort key in a cursor token; raises ValueError if it is malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8'))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not (isinstance(key, list) and len(key) == 3 and isinstance(key[0], int)
+            and isinstance(key[1], str) and isinstance(key[2], str)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
 # --- Routes ---
 
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
 
+@app.route('/blobs/<blob_name>')
+def serve_blob(blob_name):
+    # Content-addressed: the URL changes whenever the bytes do, so cache forever.
+    if not BLOB_NAME_RE.match(blob_name):
+        return "File not found", 404
+    blob_dir = os.path.dirname(_blob_path(blob_name))
+    if not os.path.isfile(os.path.join(blob_dir, blob_name)):
+        return "File not found", 404
+    response = send_from_directory(blob_dir, blob_name, max_age=365 * 24 * 3600)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def is_app_file_path(path):
+    """
+    True if path may be served from the application directory: no hidden
+    segment, and not inside a library root or the upload folder (book files
+    are only served through their book id, never as /library/...).
+    """
+    if any(part.startswith('.') for part in re.split(r'[/\\]', path)):
+        return False
+    real_path = os.path.realpath(path)
+    for folder in LIBRARY_ROOTS + [UPLOAD_FOLDER]:
+        real_folder = os.path.realpath(folder)
+        if real_path == real_folder or real_path.startswith(real_folder + os.sep):
+            return False
+    return True
+
 @app.route('/<path:path>')
 def serve_static(path):
     # 1. Try serving from root (Application files)
-    if os.path.exists(os.path.join('.', path)):
+    if is_app_file_path(path) and os.path.exists(os.path.join('.', path)):
         return send_from_directory('.', path)
     
-    # 2. Try serving from Library (Book files)
-    if os.path.exists(os.path.join(LIBRARY_FOLDER, path)):
-        return send_from_directory(LIBRARY_FOLDER, path)
-        
-    return "File not found", 404
+    # 2. Try serving from Library (Book files); one stat, then memory for small files.
+    # Only published book dirs: staging dirs, .trash and .blobs are hidden names.
+    book_dir = path.split('/', 1)[0]
+    library_root = find_book_root(book_dir, verify=False) if is_book_dir_name(book_dir) else None
+    if library_root is None:
+        return "File not found", 404
+    full_path = safe_join(library_root, path)
+    try:
+        st = os.stat(full_path) if full_path else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        return "File not found", 404
+    entry = STATIC_CACHE.lookup(full_path, st) if STATIC_CACHE_ENABLED else None
+    if entry is not None:
+        return cached_file_response(entry)
+    return send_from_directory(library_root, path)
+
+@app.route('/api/static-cache')
+def api_static_cache():
+    return jsonify(STATIC_CACHE.stats())
 
 @app.route('/api/books')
 def api_books():
     books = []
     user_meta = load_user_metadata()
-    print("Scanning for books...")
-    if os.path.exists(LIBRARY_FOLDER):
-        book_dirs = [entry for entry in os.listdir(LIBRARY_FOLDER) if is_valid_book_dir(entry)]
-        book_dir_set = set(book_dirs)
-
-        # Drop cache entries for removed directories.
-        with BOOKS_META_CACHE_LOCK:
-            for cached_dir in list(BOOKS_META_CACHE.keys()):
-                if cached_dir not in book_dir_set:
-                    BOOKS_META_CACHE.pop(cached_dir, None)
-
-        for entry in book_dirs:
-            with BOOKS_META_CACHE_LOCK:
-                cached_meta = BOOKS_META_CACHE.get(entry)
-
-            if cached_meta is None:
-                meta = get_book_metadata(entry)
-                if not meta:
-                    continue
-
-                # Ignore EPUB-provided subjects; user categories are merged below.
-                meta['subjects'] = []
-                with BOOKS_META_CACHE_LOCK:
-                    BOOKS_META_CACHE.setdefault(entry, meta)
-                    cached_meta = BOOKS_META_CACHE.get(entry)
+    # Lock-free: a published snapshot, rescanned in the background at most every LIBRARY_RESCAN_SECONDS.
+    snapshot = current_library()
+    if snapshot.books:
+        for entry, book in snapshot.books.items():
+            if book.available:
+                cached_meta = book.meta
+            else:
+                # Root is offline: keep listing the book under the same id.
+                cached_meta = dict(book.meta or {'title': entry, 'author': "Unknown", 'dir': entry, 'cover': None})
+                cached_meta['available'] = False
 
             if not cached_meta:
                 continue
@@ -570,7 +2818,7 @@ def api_user_metadata():
             user_meta[book_dir] = {}
             
         user_meta[book_dir]['categories'] = categories
-        save_user_metadata(user_meta)
+        save_user_metadata(user_meta, changed_books=[book_dir])
         
         return jsonify({'success': True, 'categories': categories})
 
@@ -636,7 +2884,7 @@ def api_book_annotations(book_dir):
         annotations = []
     annotations.append(annotation)
     user_meta[book_dir]['annotations'] = annotations
-    save_user_metadata(user_meta)
+    save_user_metadata(user_meta, changed_books=[book_dir])
 
     return jsonify({'success': True, 'annotation': annotation})
 
@@ -660,7 +2908,7 @@ def api_book_annotation_item(book_dir, anno_id):
     if request.method == 'DELETE':
         annotations.pop(index)
         user_meta[book_dir]['annotations'] = annotations
-        save_user_metadata(user_meta)
+        save_user_metadata(user_meta, changed_books=[book_dir])
         return jsonify({'success': True})
 
     data = request.get_json(silent=True) or {}
@@ -695,10 +2943,61 @@ def api_book_annotation_item(book_dir, anno_id):
 
     annotations[index]['updatedAt'] = int(time.time() * 1000)
     user_meta[book_dir]['annotations'] = annotations
-    save_user_metadata(user_meta)
+    save_user_metadata(user_meta, changed_books=[book_dir])
 
     return jsonify({'success': True, 'annotation': annotations[index]})
 
+@app.route('/api/annotations')
+def api_annotations():
+    """
+    Library-wide annotation feed as NDJSON (one annotation per line, with its
+    'book'), ordered by updatedAt. Filters: book/category (repeatable), style,
+    since/until (ms, inclusive), q (substring of text or note). Pass the
+    X-Next-Cursor header back as ?cursor= for the next page.
+    """
+    args = request.args
+    try:
+        limit = min(max(int(args.get('limit', ANNOTATION_FEED_DEFAULT_LIMIT)), 1), ANNOTATION_FEED_MAX_LIMIT)
+        since = int(args['since']) if args.get('since') else None
+        until = int(args['until']) if args.get('until') else None
+        cursor = decode_annotation_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': f"Invalid query parameter: {e}"}), 400
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'Invalid order'}), 400
+
+    annotations, next_cursor = get_annotation_index().query(
+        books=args.getlist('book') or None,
+        categories=set(args.getlist('category')),
+        style=normalize_annotation_style(args['style']) if args.get('style') else None,
+        since=since,
+        until=until,
+        q=(args.get('q') or '').strip().lower() or None,
+        cursor=cursor,
+        descending=order == 'desc',
+        limit=limit,
+    )
+
+    def generate():
+        for annotation in annotations:
+            yield json.dumps(annotation, ensure_ascii=False) + '\n'
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = encode_annotation_cursor(next_cursor)
+    return response
+
+@app.route('/api/books/<book_dir>/positions')
+def api_book_positions(book_dir):
+    if not is_valid_book_dir(book_dir):
+        return jsonify({'error': 'Invalid book directory provided.'}), 400
+
+    index = load_position_index(book_dir)
+    if index is None:
+        return jsonify({'error': 'No position index available.'}), 404
+    return jsonify(index)
+
 @app.route('/api/upload-status/<task_id>')
 def api_upload_status(task_id):
     _prune_upload_tasks()
@@ -754,13 +3053,15 @@ def api_upload():
     
     if file:
         filename = file.filename
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
         log(logs, f"File uploaded: {filename}")
 
         # Async mode: return immediately and let the client poll for progress/logs.
         if request.args.get('async') == '1':
+            # The request's spooled upload goes away with the request, so keep a copy for the worker.
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            file.save(filepath)
             categories = request.form.getlist('categories')
+            profile = profile_requested(request.path, request.args.get('profile'))
             task_id = str(uuid.uuid4())
             now = time.time()
             with UPLOAD_TASKS_LOCK:
@@ -777,71 +3078,55 @@ def api_upload():
             _task_append_log(task_id, f"Upload received: {filename}")
             worker = threading.Thread(
                 target=_process_upload_task,
-                args=(task_id, filepath, filename, categories),
+                args=(task_id, filepath, filename, categories, profile),
                 daemon=True,
             )
             worker.start()
             return jsonify({'success': True, 'task_id': task_id})
         
-        # 1. Unzip
-        # Create a directory name based on filename without extension
-        book_name_safe = os.path.splitext(filename)[0]
-        # Clean weird chars
-        book_name_safe = re.sub(r'[^\w\-\u4e00-\u9fa5]', '_', book_name_safe) 
-        
-        extract_path = os.path.join(LIBRARY_FOLDER, book_name_safe)
-        
-        # Handle collision
-        if os.path.exists(extract_path):
-            extract_path += "_" + str(uuid.uuid4())[:8]
-            
+        # Read the zip straight from the (seekable) spooled upload instead of copying it to disk again.
         try:
-            with zipfile.ZipFile(filepath, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-            log(logs, f"Extracted to: {extract_path}")
-            
-            # 2. Process Files
-            # Walk through the extracted files
-            for root, dirs, files in os.walk(extract_path):
-                for file in files:
-                    full_path = os.path.join(root, file)
-                    
-                    if file.lower().endswith('.css'):
-                        convert_css_vertical_to_horizontal(full_path, logs)
-                    
-                    if file.lower().endswith(('.html', '.xhtml')):
-                        convert_css_vertical_to_horizontal(full_path, logs) # Inline styles
-                        process_html_content(full_path, logs) # Nav injection & Title cleaning
-            
-            # Cleanup Upload
-            os.remove(filepath)
-            
-            # 3. Save Metadata (Categories) if provided
-            categories = request.form.getlist('categories')
-            if categories:
-                user_meta = load_user_metadata()
-                book_dir_name = os.path.basename(extract_path)
-                if book_dir_name not in user_meta:
-                    user_meta[book_dir_name] = {}
-                
-                # Add to categories, avoiding duplicates
-                current_cats = user_meta[book_dir_name].get('categories', [])
-                for cat in categories:
-                    cat = cat.strip()
-                    if cat and cat not in current_cats:
-                        current_cats.append(cat)
-                
-                user_meta[book_dir_name]['categories'] = current_cats
-                save_user_metadata(user_meta)
-                log(logs, f"Added categories: {', '.join(categories)}")
-
-            book_dir_name = os.path.basename(extract_path)
-            invalidate_books_meta_cache(book_dir_name)
+            book_dir_name = import_book_archive(
+                file.stream, filename, logs, categories=request.form.getlist('categories'),
+            )
             return jsonify({'success': True, 'logs': logs, 'book_dir': book_dir_name})
-
         except Exception as e:
             log(logs, f"Error processing: {e}")
-            return jsonify({'success': False, 'logs': logs, 'error': str(e)}), 500
+            status = 400 if isinstance(e, (ArchiveImportError, zipfile.BadZipFile)) else 500
+            return jsonify({'success': False, 'logs': logs, 'error': str(e)}), status
+
+@app.route('/api/library/export')
+def api_library_export():
+    # ?book=<dir> (repeatable) selects books; default is the whole library.
+    requested = request.args.getlist('book')
+    if requested:
+        invalid = [b for b in requested if not is_valid_book_dir(b)]
+        if invalid:
+            return jsonify({'error': f"Invalid book directory: {invalid[0]}"}), 400
+        book_dirs = requested
+    else:
+        book_dirs = list_book_dirs()
+
+    filename = f"epub-library-{time.strftime('%Y%m%d-%H%M%S')}.tar"
+    return Response(
+        iter_library_archive(book_dirs),
+        mimetype='application/x-tar',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+@app.route('/api/library/import', methods=['POST'])
+def api_library_import():
+    # Body is the raw tar stream produced by /api/library/export.
+    logs = []
+    try:
+        result = restore_library_archive(request.stream, logs)
+    except (ArchiveImportError, tarfile.TarError) as e:
+        log(logs, f"Error restoring library: {e}")
+        return jsonify({'success': False, 'logs': logs, 'error': str(e)}), 400
+    except Exception as e:
+        log(logs, f"Error restoring library: {e}")
+        return jsonify({'success': False, 'logs': logs, 'error': str(e)}), 500
+    return jsonify({'success': True, 'logs': logs, **result})
 
 @app.route('/api/books/<book_dir>', methods=['DELETE'])
 def api_delete_book(book_dir):
@@ -849,27 +3134,30 @@ def api_delete_book(book_dir):
     if ".." in book_dir or book_dir.startswith('/'):
         return jsonify({'error': 'Invalid book directory provided.'}), 400
     
-    full_path = os.path.join(LIBRARY_FOLDER, book_dir)
-    
-    # Ensure it's a valid book directory that we manage
-    # Check if the directory exists and is not one of the protected IGNORE_DIRS
-    if not os.path.isdir(full_path) or book_dir in IGNORE_DIRS:
+    # Ensure it's a valid book directory that we manage, on whichever root holds it
+    full_path = resolve_book_path(book_dir)
+    if full_path is None:
         return jsonify({'error': 'Book not found or is a protected directory.'}), 404
     
     try:
-        shutil.rmtree(full_path)
+        # Instant rename; files (and blobs only this book used) are reclaimed in the background.
+        move_to_trash(full_path)
+        unpublish_book(book_dir)
+        STATIC_CACHE.discard_prefix(full_path + os.sep)
         # Keep user metadata in sync: remove any stored metadata for this book dir.
         user_meta = load_user_metadata()
         if book_dir in user_meta:
             user_meta.pop(book_dir, None)
-            save_user_metadata(user_meta)
-        invalidate_books_meta_cache(book_dir)
-        print(f"Deleted book directory: {full_path}")
+            save_user_metadata(user_meta, changed_books=[book_dir])
+        print(f"Moved book directory to trash: {full_path}")
         return jsonify({'success': True, 'message': f'Book "{book_dir}" deleted.'}), 200
     except Exception as e:
         print(f"Error deleting book {book_dir}: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 if __name__ == '__main__':
+    start_maintenance_scheduler()
+    # Scan every root and publish the first library snapshot in the background.
+    threading.Thread(target=scan_library, daemon=True).start()
     print("Starting server on port 8000...")
     app.run(host='0.0.0.0', port=8000)
@@ -1,5 +1,5 @@
 /* eslint-disable no-undef */
-const STATIC_CACHE = 'epub-reader-static-v31';
+const STATIC_CACHE = 'epub-reader-static-v34';
 
 const STATIC_ASSETS = [
   '/',
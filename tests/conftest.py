@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+CONTAINER_XML = (
+    '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+    '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>'
+    '</container>'
+)
+CONTENT_OPF = (
+    '<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+    '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{title}</dc:title></metadata>'
+    '<manifest><item id="c1" href="text/ch1.xhtml" media-type="application/xhtml+xml"/></manifest>'
+    '<spine><itemref idref="c1"/></spine></package>'
+)
+
+
+def write_book(path, title='Book'):
+    """Writes a minimal unpacked EPUB (container, OPF, one chapter) at path."""
+    files = {
+        'META-INF/container.xml': CONTAINER_XML,
+        'OEBPS/content.opf': CONTENT_OPF.format(title=title),
+        'OEBPS/text/ch1.xhtml': '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>Hi</p></body></html>',
+    }
+    for rel, data in files.items():
+        full_path = os.path.join(path, rel)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    return path
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """An empty, unscanned library in a temporary working directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(server.app, 'root_path', str(tmp_path))
+    os.makedirs(server.LIBRARY_FOLDER)
+    os.makedirs(server.UPLOAD_FOLDER)
+    monkeypatch.setattr(server, 'LIBRARY_ROOTS', [server.LIBRARY_FOLDER])
+    monkeypatch.setitem(server._LIBRARY, 'snapshot', server.LibrarySnapshot({}, {}, 0))
+    monkeypatch.setitem(server._ROOT_INDEX, 'saved', None)
+    for field, value in (('key', None), ('index', None), ('building', False), ('pending', None)):
+        monkeypatch.setitem(server._ANNOTATION_INDEX, field, value)
+    monkeypatch.setattr(server, 'STATIC_CACHE_ENABLED', False)
+    monkeypatch.setattr(server, 'SLOW_REQUEST_THRESHOLD_MS', None)
+    return tmp_path
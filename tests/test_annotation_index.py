@@ -0,0 +1,107 @@
+import json
+import os
+import random
+import time
+
+import server
+from conftest import write_book
+
+
+def make_user_meta(books=20, per_book=30, seed=1):
+    rng = random.Random(seed)
+    words = ['moon', 'river', '月光', '读书', 'night', 'echo']
+    return {
+        f'book{b}': {
+            'categories': ['fav'] if b % 3 == 0 else [],
+            'annotations': [
+                {
+                    'id': f'{b}-{i}',
+                    'updatedAt': rng.randint(1, 10 ** 6),
+                    'style': rng.choice(['bg', 'ul']),
+                    'text': ' '.join(rng.choices(words, k=4)),
+                    'note': rng.choice(['', 'great note', '月光']),
+                }
+                for i in range(per_book)
+            ],
+        }
+        for b in range(books)
+    }
+
+
+def assert_same_index(actual, expected):
+    assert actual.keys == expected.keys
+    assert actual.records == expected.records
+    assert actual.by_book == expected.by_book
+    assert actual.categories == expected.categories
+    assert actual.grams == expected.grams
+
+
+def test_with_books_matches_a_full_rebuild():
+    user_meta = make_user_meta()
+    index = server.AnnotationIndex(user_meta)
+
+    user_meta['book1']['annotations'][0]['note'] = 'edited 月光 note'
+    user_meta['book1']['annotations'].pop()
+    user_meta['book2']['categories'] = ['fav']
+    user_meta['book3']['annotations'].append({'id': 'new', 'updatedAt': 5, 'text': 'brand new'})
+    del user_meta['book4']
+    user_meta['book99'] = {'annotations': [{'id': 'x', 'updatedAt': 7, 'text': 'other'}]}
+    changed = ['book1', 'book2', 'book3', 'book4', 'book99']
+
+    assert_same_index(index.with_books(user_meta, changed), server.AnnotationIndex(user_meta))
+
+
+def test_query_pages_through_candidates_in_order():
+    user_meta = make_user_meta()
+    index = server.AnnotationIndex(user_meta)
+    expected = sorted(
+        (a['updatedAt'], book, a['id']) for book, entry in user_meta.items() for a in entry['annotations']
+        if '月光' in f"{a['text']}\n{a['note']}" and book in ('book3', 'book6')
+    )
+    seen, cursor = [], None
+    while True:
+        page, cursor = index.query(books={'book3', 'book6'}, q='月光', cursor=cursor, descending=False, limit=7)
+        seen += [(a['updatedAt'], a['book'], a['id']) for a in page]
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def feed_ids(client):
+    response = client.get('/api/annotations?limit=1000')
+    return [json.loads(line)['id'] for line in response.data.decode('utf-8').splitlines()]
+
+
+def test_annotation_writes_patch_the_feed_without_a_rebuild(library):
+    write_book(os.path.join(server.LIBRARY_FOLDER, 'book'))
+    server.scan_library()
+    client = server.app.test_client()
+    assert feed_ids(client) == []
+
+    created = client.post('/api/books/book/annotations', json={
+        'href': 'book/OEBPS/text/ch1.xhtml', 'anchorId': 'p1', 'start': 0, 'end': 2, 'text': 'Hi',
+    }).json['annotation']
+    assert feed_ids(client) == [created['id']]
+    assert not server._ANNOTATION_INDEX['building']
+
+    client.put(f"/api/books/book/annotations/{created['id']}", json={'note': 'moonlight'})
+    page, _ = server.get_annotation_index().query(q='moonlight')
+    assert [a['id'] for a in page] == [created['id']]
+
+    client.delete(f"/api/books/book/annotations/{created['id']}")
+    assert feed_ids(client) == []
+    assert not server._ANNOTATION_INDEX['building']
+
+
+def test_out_of_band_changes_are_picked_up_by_a_rebuild(library):
+    client = server.app.test_client()
+    server.save_user_metadata({})
+    assert feed_ids(client) == []
+
+    with open(server.USER_METADATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(make_user_meta(books=1, per_book=3), f)
+    feed_ids(client)  # serves the previous index and starts the rebuild
+    deadline = time.time() + 10
+    while server._ANNOTATION_INDEX['building'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(feed_ids(client)) == ['0-0', '0-1', '0-2']
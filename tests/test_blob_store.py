@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import server
+from conftest import write_book
+
+OTHER_FS = '/dev/shm'
+
+
+@pytest.fixture
+def other_root(library, monkeypatch):
+    """A second library root on another filesystem (tmpfs), as with a restore onto another disk."""
+    if not os.path.isdir(OTHER_FS) or os.stat(OTHER_FS).st_dev == os.stat(library).st_dev:
+        pytest.skip("needs a second filesystem")
+    root = tempfile.mkdtemp(dir=OTHER_FS)
+    monkeypatch.setattr(server, 'LIBRARY_ROOTS', [server.LIBRARY_FOLDER, root])
+    yield root
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def write_deduped_book(book_path, data):
+    """A book as restored from an archive: its chapter already points at /blobs/."""
+    write_book(book_path)
+    image_path = os.path.join(book_path, 'OEBPS', 'images', 'pic.gif')
+    os.makedirs(os.path.dirname(image_path))
+    with open(image_path, 'wb') as f:
+        f.write(data)
+    blob_name = server._hash_file(image_path) + '.gif'
+    with open(os.path.join(book_path, 'OEBPS', 'text', 'ch1.xhtml'), 'w') as f:
+        f.write(f'<html><body><img src="/blobs/{blob_name}"/></body></html>')
+    with open(os.path.join(book_path, server.BLOB_MANIFEST_FILE), 'w') as f:
+        json.dump({'OEBPS/images/pic.gif': blob_name}, f)
+    return blob_name
+
+
+def test_restore_onto_other_filesystem_keeps_blob_urls_working(other_root):
+    staging_path = server.staging_path_for(other_root, 'book', kind='restore')
+    blob_name = write_deduped_book(staging_path, os.urandom(8192))
+
+    server._finalize_restored_book(staging_path, 'book')
+
+    client = server.app.test_client()
+    assert client.get('/book/OEBPS/text/ch1.xhtml').status_code == 200
+    assert client.get('/blobs/' + blob_name).status_code == 200
+
+
+def test_store_copy_is_kept_while_a_book_on_other_filesystem_lists_it(other_root, monkeypatch):
+    staging_path = server.staging_path_for(other_root, 'book', kind='restore')
+    blob_name = write_deduped_book(staging_path, os.urandom(8192))
+    server._finalize_restored_book(staging_path, 'book')
+    monkeypatch.setattr(server, 'BLOB_PRUNE_GRACE_SECONDS', 0)
+
+    assert server.prune_blobs([blob_name]) == 0
+    shutil.rmtree(os.path.join(other_root, 'book'))
+    assert server.prune_blobs([blob_name]) == 1
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'epub_quirks')
+
+
+def book(title, author, cover, subjects=()):
+    return {'title': title, 'author': author, 'cover': cover, 'subjects': list(subjects)}
+
+
+# Expected get_book_metadata output for each quirk in the corpus. Everything but
+# latin1 matches what the old glob + BeautifulSoup implementation returned.
+GOLDEN = {
+    # EPUB3 manifest item with properties="cover-image"
+    'e3': book('T 1', 'A 1', 'e3/OEBPS/images/c.jpg', ['S1']),
+    # EPUB2 <meta name="cover"> pointing at a manifest id
+    'e2id': book('T 2', 'A 2', 'e2id/OEBPS/images/c.jpg', ['S1']),
+    # EPUB2 <meta name="cover"> holding a path instead of an id
+    'e2path': book('T 3', 'A 3', 'e2path/OEBPS/images/c.jpg', ['S1']),
+    # EPUB2 <meta name="cover"> pointing at an XHTML wrapper page
+    'e2xhtml': book('T 4', 'A 4', 'e2xhtml/OEBPS/images/c.jpg', ['S1']),
+    # Cover page that wraps the image in <svg><image xlink:href>
+    'svg': book('T 5', 'A 5', 'svg/OEBPS/images/c.jpg', ['S1']),
+    # Cover page that is not well-formed XML (lenient HTML fallback)
+    'brokenxhtml': book('T 6', 'A 6', 'brokenxhtml/OEBPS/images/c.jpg', ['S1']),
+    # No cover hints at all: no guessing from arbitrary images
+    'fallback': book('T 7', 'A 7', None, ['S1']),
+    # OPF without namespaces
+    'noprefix': book('Plain', 'Bob', 'noprefix/OEBPS/images/c.jpg'),
+    # opf:-prefixed elements, percent-encoded href, multi-valued properties
+    'opfprefix': book('Pref x\n', 'Unknown', 'opfprefix/OEBPS/images/c x.jpg'),
+    # Empty metadata falls back to the directory name
+    'notitle': book('notitle', 'Unknown', None),
+    # No META-INF/container.xml: recursive glob fallback; cover outside the book is refused
+    'nocontainer': book('T 9', 'A 9', None, ['S1']),
+    # Cover href escaping the book directory
+    'escape': book('T 10', 'A 10', None, ['S1']),
+    # Non-ASCII title, author and cover file name
+    'cjk': book('三体', '刘慈欣', 'cjk/OEBPS/images/封面.jpg'),
+    # container.xml names the OPF; a decoy OPF sorts first on disk
+    'multi': book('T right', 'A right', None, ['S1']),
+    # Unclosed tags and a bare ampersand
+    'malformed': book('Broken  co', 'X', 'malformed/OEBPS/c.jpg'),
+    # ISO-8859-1 OPF (the old reader fell back to the directory name here)
+    'latin1': book('Café', 'Unknown', None),
+}
+
+
+def test_corpus_is_fully_covered():
+    assert sorted(os.listdir(FIXTURES)) == sorted(GOLDEN)
+
+
+@pytest.mark.parametrize('book_dir', sorted(GOLDEN))
+def test_get_book_metadata(book_dir):
+    meta = server.get_book_metadata(book_dir, book_path=os.path.join(FIXTURES, book_dir))
+    expected = dict(GOLDEN[book_dir], dir=book_dir)
+    assert meta == expected
+
+
+def test_missing_opf_returns_none(tmp_path):
+    (tmp_path / 'empty').mkdir()
+    assert server.get_book_metadata('empty', book_path=str(tmp_path / 'empty')) is None
@@ -0,0 +1,69 @@
+import os
+import shutil
+import threading
+
+import server
+from conftest import write_book
+
+
+def test_scan_keeps_publishes_and_deletes_made_while_listing(library, monkeypatch):
+    for book_dir in ('old', 'gone'):
+        write_book(os.path.join(server.LIBRARY_FOLDER, book_dir))
+    server.scan_library()
+    list_root = server._list_root
+
+    def list_root_then_change(root):
+        listing = list_root(root)
+        book_dir = server.reserve_book_dir('new')
+        try:
+            staging_path = server.staging_path_for(root, book_dir)
+            write_book(staging_path)
+            server.publish_book(staging_path, book_dir)
+        finally:
+            server.release_book_dir(book_dir)
+        shutil.rmtree(os.path.join(root, 'gone'))
+        server.unpublish_book('gone')
+        return listing
+
+    monkeypatch.setattr(server, '_list_root', list_root_then_change)
+    snapshot = server.scan_library()
+
+    assert sorted(snapshot.books) == ['new', 'old']
+    assert snapshot.root_books[server.LIBRARY_FOLDER] == {'new', 'old'}
+
+
+def test_first_library_scan_runs_inline(library, monkeypatch):
+    scanned_on = []
+    scan_library = server.scan_library
+
+    def recording_scan():
+        scanned_on.append(threading.current_thread())
+        return scan_library()
+
+    monkeypatch.setattr(server, 'scan_library', recording_scan)
+    assert server.current_library().scanned_at
+    assert scanned_on == [threading.current_thread()]
+
+
+def test_stale_library_is_rescanned_in_background(library, monkeypatch):
+    write_book(os.path.join(server.LIBRARY_FOLDER, 'book'))
+    first = server.scan_library()
+    monkeypatch.setattr(server, 'LIBRARY_RESCAN_SECONDS', 0)
+    release = threading.Event()
+    scanned_on = []
+
+    def blocking_scan():
+        scanned_on.append(threading.current_thread())
+        release.wait(5)
+        return server.library_snapshot()
+
+    monkeypatch.setattr(server, 'scan_library', blocking_scan)
+    try:
+        assert server.current_library() is first
+        assert server.current_library() is first  # no second scan while one is running
+    finally:
+        release.set()
+    assert server._LIBRARY_SCAN_LOCK.acquire(timeout=5)
+    server._LIBRARY_SCAN_LOCK.release()
+    assert len(scanned_on) == 1
+    assert scanned_on[0] is not threading.current_thread()
@@ -0,0 +1,32 @@
+import os
+import time
+
+import server
+
+
+def make_staging_dir(book_dir, kind='import'):
+    path = server.staging_path_for(server.LIBRARY_FOLDER, book_dir, kind=kind)
+    os.makedirs(os.path.join(path, 'OEBPS'))
+    old = time.time() - server.MAINTENANCE_STALE_SECONDS - 60
+    os.utime(path, (old, old))
+    return path
+
+
+def test_sweep_orphans_trashes_abandoned_staging_dirs(library):
+    path = make_staging_dir('gone-book')
+
+    assert server.sweep_orphans() == 1
+    assert not os.path.exists(path)
+
+
+def test_sweep_orphans_keeps_staging_dirs_of_running_imports(library):
+    book_dir = server.reserve_book_dir('long-import')
+    try:
+        import_path = make_staging_dir(book_dir)
+        restore_path = make_staging_dir(book_dir, kind='restore')
+
+        assert server.sweep_orphans() == 0
+        assert os.path.isdir(import_path)
+        assert os.path.isdir(restore_path)
+    finally:
+        server.release_book_dir(book_dir)
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+import server
+from conftest import write_book
+
+HIDDEN_FILES = (
+    '.import-deadbeef-zz/OEBPS/x.html',
+    '.restore-deadbeef-zz/OEBPS/x.html',
+    '.trash/1-deadbeef-zz/OEBPS/x.html',
+    '.blobs/0123abcd.gif',
+    '.library-roots.json',
+)
+
+
+@pytest.fixture
+def client(library):
+    write_book(os.path.join(server.LIBRARY_FOLDER, 'book'))
+    for rel in HIDDEN_FILES:
+        full_path = os.path.join(server.LIBRARY_FOLDER, rel)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write('hidden')
+    with open('index.html', 'w') as f:
+        f.write('<html></html>')
+    server.scan_library()
+    return server.app.test_client()
+
+
+def test_serves_published_book_files(client):
+    assert client.get('/book/OEBPS/text/ch1.xhtml').status_code == 200
+
+
+def test_serves_app_files(client):
+    assert client.get('/index.html').status_code == 200
+
+
+@pytest.mark.parametrize('rel', HIDDEN_FILES)
+@pytest.mark.parametrize('prefix', ['/', '/library/'])
+def test_refuses_hidden_library_paths(client, prefix, rel):
+    assert client.get(prefix + rel).status_code == 404
+
+
+def test_refuses_book_files_under_library_prefix(client):
+    assert client.get('/library/book/OEBPS/text/ch1.xhtml').status_code == 404